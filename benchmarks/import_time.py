@@ -0,0 +1,59 @@
+"""
+Guards the lazy imports of helpers/__init__.py: 'import helpers' must not pull in the heavy
+dependencies of the submodules.
+
+    python benchmarks/import_time.py
+
+Imports helpers in fresh interpreters, prints the import time (best of 5 runs) and exits with an
+error if one of HEAVY_MODULES was imported.
+"""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+HEAVY_MODULES = [
+    "torch",
+    "torchvision",
+    "pandas",
+    "numpy",
+    "plotly",
+    "matplotlib",
+    "PIL",
+    "httpx",
+    "pyinstrument",
+]
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import helpers
+elapsed = time.perf_counter() - start
+modules = sorted(m for m in sys.modules if m.split(".")[0] in %r)
+print(json.dumps({"elapsed": elapsed, "modules": modules}))
+"""
+
+
+def measure(repeat: int = 5) -> dict:
+    runs = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", _CHILD % HEAVY_MODULES],
+                cwd=Path(__file__).resolve().parents[1],
+                capture_output=True,
+                check=True,
+                text=True,
+            ).stdout
+        )
+        for _ in range(repeat)
+    ]
+    return {"elapsed": min(r["elapsed"] for r in runs), "modules": runs[0]["modules"]}
+
+
+if __name__ == "__main__":
+    result = measure()
+    print(f"import helpers: {result['elapsed'] * 1e3:.0f}ms")
+    if result["modules"]:
+        sys.exit(f"import helpers imported heavy modules: {', '.join(result['modules'])}")
+    print("No heavy modules imported.")
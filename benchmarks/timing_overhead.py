@@ -0,0 +1,30 @@
+"""
+Per-call overhead of the time_execution decorator: time of a decorated no-op function minus the time
+of the plain function, best of 'repeat' runs of 'number' calls each.
+
+    python benchmarks/timing_overhead.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from helpers.decorators import TimingRegistry, time_execution
+
+
+def _noop(x):
+    return x
+
+
+def measure(number: int = 1_000_000, repeat: int = 7) -> float:
+    """Overhead per call in seconds."""
+    decorated = time_execution(registry=TimingRegistry())(_noop)
+    plain = min(timeit.repeat(lambda: _noop(1), number=number, repeat=repeat))
+    timed = min(timeit.repeat(lambda: decorated(1), number=number, repeat=repeat))
+    return (timed - plain) / number
+
+
+if __name__ == "__main__":
+    print(f"time_execution overhead: {measure() * 1e9:.0f}ns per call")
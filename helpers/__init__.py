@@ -1,31 +1,77 @@
-from loguru import logger
-
-from .concurrent_helpers import *
-from .decorators import *
-from .download import *
-from .files import *
-from .pandas_utils import *
-from .visualization import *
-
-
-def isnotebook():
-    try:
-        shell = get_ipython().__class__.__name__
-        return shell == "ZMQInteractiveShell"
-    except NameError:
-        return False  # Probably standard Python interpreter
-
-
-if isnotebook():
-    from tqdm.notebook import tqdm
-else:
-    from tqdm import tqdm
-
-logger.remove()
-logger.add(
-    lambda msg: tqdm.write(msg, end=""),
-    colorize=True,
-    enqueue=True,
-    level="INFO",
-    backtrace=True,
+"""
+Submodules are imported lazily (PEP 562): 'import helpers' only sets up logging, and e.g. the torch,
+plotly and matplotlib imports of helpers.visualization only happen once one of its names is
+accessed.
+"""
+
+import importlib
+
+from .logging_utils import configure_logging, isnotebook
+
+# public name -> submodule (relative) or module (absolute) it is imported from
+_LAZY_NAMES = {
+    "execute_all_with_results": ".concurrent_helpers",
+    "profile": ".decorators",
+    "execute_if_older": ".decorators",
+    "memoize": ".decorators",
+    "time_execution": ".decorators",
+    "TimingRegistry": ".decorators",
+    "TIMINGS": ".decorators",
+    "download_images_from_df": ".download",
+    "download_images_from_chunks": ".download",
+    "RetryPolicy": ".download",
+    "HostLimiter": ".download",
+    "get_file_creation_time": ".files",
+    "get_file_age_in_days": ".files",
+    "get_last_modified_time": ".files",
+    "match_search_str_in_dir": ".files",
+    "get_dir_index": ".files",
+    "save_structure": ".files",
+    "load_structure": ".files",
+    "detailed_df_info": ".pandas_utils",
+    "optimize_df_memory": ".pandas_utils",
+    "read_chunks": ".pandas_utils",
+    "process_chunks": ".pandas_utils",
+    "write_chunks": ".pandas_utils",
+    "ChunkWriter": ".pandas_utils",
+    "visualize_pt_image_tensor": ".visualization",
+    "visualize_image_grid": ".visualization",
+    "image_grid": ".visualization",
+    "image_grid_pages": ".visualization",
+    "feature_target_correlations": ".visualization",
+    "PLOTLY_DEF_LAYOUT": ".visualization",
+    "logger": "loguru",
+    "tqdm": "tqdm.notebook" if isnotebook() else "tqdm",
+}
+
+# submodules that 'import helpers' used to import eagerly, so helpers.download etc. keep working
+# without an explicit import (others, like helpers.metrics, still need one)
+_LAZY_SUBMODULES = (
+    "concurrent_helpers",
+    "decorators",
+    "download",
+    "files",
+    "pandas_utils",
+    "visualization",
 )
+
+__all__ = ["configure_logging", "isnotebook", *_LAZY_NAMES, *_LAZY_SUBMODULES]
+
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    if name not in _LAZY_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name = _LAZY_NAMES[name]
+    module = importlib.import_module(module_name, __name__ if module_name.startswith(".") else None)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted({*globals(), *_LAZY_NAMES, *_LAZY_SUBMODULES})
+
+
+configure_logging()
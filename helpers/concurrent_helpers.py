@@ -1,40 +1,194 @@
-from typing import Dict, List, Callable
-from threading import Thread
-import queue
+from typing import Any, Dict, List, Callable, Optional, Set, Tuple
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    FIRST_COMPLETED,
+    wait,
+)
+from threading import Thread, Lock
 import asyncio
 import inspect
+import time
 
 __all__ = ["execute_all_with_results"]
 
+_lock = Lock()
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
 
-def execute_all_with_results(funcs: List[Callable], args: Dict[str, Dict] = {}):
+
+def _get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    with _lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(thread_name_prefix="execute_all_with_results")
+        return _thread_pool
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor()
+        return _process_pool
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Shared event loop, running forever in a daemon thread. All coroutine functions run on it."""
+    global _event_loop
+    with _lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            Thread(
+                target=_event_loop.run_forever, name="execute_all_with_results_loop", daemon=True
+            ).start()
+        return _event_loop
+
+
+def _call_timed(f: Callable, kwargs: Dict) -> Tuple[Any, float, float]:
+    start = time.time()
+    result = f(**kwargs)
+    return result, start, time.time()
+
+
+async def _call_timed_async(f: Callable, kwargs: Dict) -> Tuple[Any, float, float]:
+    start = time.time()
+    result = await f(**kwargs)
+    return result, start, time.time()
+
+
+def _submit(f: Callable, args: Dict, executor: Executor, timeout: Optional[float]) -> Future:
+    if inspect.iscoroutinefunction(f):
+        coro = _call_timed_async(f, args)
+        if timeout is not None:
+            coro = asyncio.wait_for(coro, timeout)
+        return asyncio.run_coroutine_threadsafe(coro, _get_event_loop())
+    return executor.submit(_call_timed, f, args)
+
+
+def _check_dependencies(names: Set[str], dependencies: Dict[str, List[str]]) -> None:
+    for name, deps in dependencies.items():
+        for n in [name, *deps]:
+            if n not in names:
+                raise ValueError(f"Unknown function {n} in dependencies.")
+
+    remaining = {n: set(dependencies.get(n, [])) for n in names}
+    while ready := [n for n, deps in remaining.items() if not deps]:
+        for n in ready:
+            del remaining[n]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    if remaining:
+        raise ValueError(f"Circular dependencies between {', '.join(remaining)}.")
+
+
+def execute_all_with_results(
+    funcs: List[Callable],
+    args: Dict[str, Dict] = {},
+    timeout: Optional[float] = None,
+    executor: str = "thread",
+    return_exceptions: bool = False,
+    dependencies: Dict[str, List[str]] = {},
+    return_timings: bool = False,
+):
     """
-    Provide a list of functions to execute in seperate threads.
+    Provide a list of functions to execute concurrently.
     Useful if there are multiple IO-bound functions that need to be executed (e.g. for class init).
     If one or multiple of the function require arguments, provide them like so:
     args = {'func_name_1': {arg1: 4, arg2: 'test'}}.
     Returns dictionary with key-value pairs function_name: function_return_value. Therefore, unique function
     names should be provided in funcs.  Can handle coroutines.
+
+    If functions need the results of other functions, declare it like so:
+    dependencies = {'func_name_3': ['func_name_1', 'func_name_2']}.
+    'func_name_3' is then started as soon as both dependencies have finished, and receives their
+    results as the keyword arguments func_name_1 and func_name_2.
+
+    Coroutine functions all run together on one shared event loop, regular functions on a
+    persistent, size-bounded thread pool. Set executor='process' to run regular functions on a
+    process pool instead (for CPU-bound work, functions and arguments need to be picklable).
+    'timeout' (seconds, counted from submission) applies to every function. If a function raises or
+    times out, all functions that have not finished yet are cancelled and the exception is raised.
+    Coroutines are cancelled properly, functions that are already running in a thread can't be
+    interrupted. With return_exceptions=True, exceptions are returned as results instead (dependents
+    of a failed function are not executed).
+
+    With return_timings=True, a tuple (results, timings) is returned. timings holds for every
+    executed function the 'submitted', 'start' and 'end' times in seconds since the call, plus the
+    dependency that finished last as 'blocked_by'. Following 'blocked_by' back from the function
+    that finished last gives the critical path.
     """
 
-    res_queue = queue.Queue()
+    if executor == "thread":
+        pool = _get_thread_pool()
+    elif executor == "process":
+        pool = _get_process_pool()
+    else:
+        raise ValueError(f"Unknown executor {executor}, use 'thread' or 'process'.")
+
+    funcs_by_name = {f.__name__: f for f in funcs}
+    _check_dependencies(set(funcs_by_name), dependencies)
+
+    remaining = {name: set(dependencies.get(name, [])) for name in funcs_by_name}
+    futures: Dict[Future, str] = {}
+    deadlines: Dict[Future, float] = {}
+    results, timings = {}, {}
+    t0 = time.time()
+
+    def _submit_ready():
+        for name in [n for n, deps in remaining.items() if not deps]:
+            del remaining[name]
+            kwargs = {**args.get(name, {}), **{d: results[d] for d in dependencies.get(name, [])}}
+            fut = _submit(funcs_by_name[name], kwargs, pool, timeout)
+            futures[fut] = name
+            timings[name] = {"submitted": time.time() - t0}
+            if timeout is not None:
+                deadlines[fut] = time.monotonic() + timeout
+
+    def _handle_exception(name: str, exc: BaseException):
+        if not return_exceptions:
+            raise exc
+        results[name] = exc
+        for n in [n for n, deps in remaining.items() if name in deps]:
+            del remaining[n]
+            _handle_exception(n, RuntimeError(f"{n} was not executed, dependency {name} failed."))
+
+    try:
+        _submit_ready()
+        while futures:
+            wait_timeout = min(deadlines.values()) - time.monotonic() if deadlines else None
+            done, _ = wait(futures, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+
+            for fut in done:
+                name = futures.pop(fut)
+                deadlines.pop(fut, None)
+                if (exc := fut.exception()) is not None:
+                    _handle_exception(name, exc)
+                    continue
+                results[name], start, end = fut.result()
+                timings[name].update(start=start - t0, end=end - t0)
+                for deps in remaining.values():
+                    deps.discard(name)
 
-    def _exc_and_put_result(f: Callable, args: Dict):
-        if inspect.iscoroutinefunction(f):
-            res_queue.put({f.__name__: asyncio.run(f(**args))})
-        else:
-            res_queue.put({f.__name__: f(**args)})
+            for fut in [f for f, deadline in deadlines.items() if deadline <= time.monotonic()]:
+                name = futures.pop(fut)
+                del deadlines[fut]
+                fut.cancel()
+                _handle_exception(name, TimeoutError(f"{name} did not finish within {timeout}s."))
 
-    threads = []
-    for f in funcs:
-        thread = Thread(target=_exc_and_put_result, args=(f, args.get(f.__name__, {})))
-        thread.start()
-        threads.append(thread)
+            _submit_ready()
+    finally:
+        for fut in futures:
+            fut.cancel()
 
-    for t in threads:
-        t.join()
+    results = {name: results[name] for name in funcs_by_name}
+    if not return_timings:
+        return results
 
-    results = {}
-    while not res_queue.empty():
-        results.update(res_queue.get())
-    return results
+    for name, deps in dependencies.items():
+        if name in timings and deps:
+            timings[name]["blocked_by"] = max(deps, key=lambda d: timings[d].get("end", 0))
+    return results, timings
@@ -1,23 +1,184 @@
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence
+import atexit
+import dataclasses
+import datetime
 import functools
-from pathlib import Path
-from timeit import default_timer as timer
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+from enum import Enum
+from pathlib import Path, PurePath
+from time import perf_counter_ns
 from functools import wraps
 
-from line_profiler import LineProfiler
 from loguru import logger
-from pyinstrument import Profiler
 
-from .files import get_file_age_in_days
+from .files import get_file_age_in_days, _dump_pickle5, _load_pickle5
 
-__all__ = ["profile", "execute_if_older"]
+if TYPE_CHECKING:
+    from pyinstrument.session import Session
 
+__all__ = ["profile", "execute_if_older", "memoize", "time_execution", "TimingRegistry", "TIMINGS"]
 
-def profile(func):
+
+# Renderer class name in pyinstrument.renderers and file extension. pyinstrument and line_profiler
+# are only imported once something is profiled, so importing this module stays cheap.
+_REPORT_FORMATS = {
+    "html": ("HTMLRenderer", "html"),
+    "json": ("JSONRenderer", "json"),
+    "speedscope": ("SpeedscopeRenderer", "speedscope.json"),
+    "text": ("ConsoleRenderer", "txt"),
+}
+
+
+class SampledProfile:
+    """
+    Aggregates pyinstrument sessions of sampled calls into one session and writes it as reports into
+    'output_dir'. Thread-safe; sessions are only merged when reports are written.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        output_dir: Path,
+        every: Optional[int] = None,
+        fraction: Optional[float] = None,
+        formats: Sequence[str] = ("html",),
+    ):
+        for fmt in formats:
+            if fmt not in _REPORT_FORMATS:
+                raise ValueError(
+                    f"Unknown report format {fmt}, use one of {list(_REPORT_FORMATS)}."
+                )
+        self.name = name
+        self.output_dir = Path(output_dir)
+        self.every = every
+        self.fraction = fraction
+        self.formats = formats
+        self.calls = 0
+        self.profiled_calls = 0
+        self._sessions: List["Session"] = []
+        self._lock = threading.Lock()
+
+    def should_profile(self) -> bool:
+        with self._lock:
+            self.calls += 1
+            if self.every is not None:
+                return (self.calls - 1) % self.every == 0
+            return random.random() < (self.fraction if self.fraction is not None else 1.0)
+
+    def add(self, session: "Session") -> None:
+        with self._lock:
+            self._sessions.append(session)
+            self.profiled_calls += 1
+
+    def write_reports(self) -> List[Path]:
+        """Writes the reports of all profiled calls, replacing previous ones. Returns the paths."""
+        from pyinstrument import renderers
+        from pyinstrument.session import Session
+
+        with self._lock:
+            if not self._sessions:
+                return []
+            session = functools.reduce(Session.combine, self._sessions)
+            self._sessions = [session]
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for fmt in self.formats:
+            renderer, extension = _REPORT_FORMATS[fmt]
+            path = self.output_dir / f"{self.name}.{extension}"
+            path.write_text(getattr(renderers, renderer)().render(session), encoding="utf-8")
+            paths.append(path)
+        logger.info(
+            f"Profile of {self.profiled_calls}/{self.calls} calls of {self.name} written to "
+            f"{self.output_dir}."
+        )
+        return paths
+
+
+def profile(
+    func=None,
+    *,
+    every: Optional[int] = None,
+    fraction: Optional[float] = None,
+    output_dir: Optional[Path] = None,
+    formats: Sequence[str] = ("html",),
+    interval: float = 0.001,
+):
     """
     Profiles the decorated function or method and renders the results as foldable HTML in the browser.
     The decorator uses statistical profiling, not tracing, therefore has much lower overhead.
     It is meant to be used to identify the slowest part in a piece of code, not for accurate tracing of every call.
+
+    Sampling mode (for hot paths and headless servers), enabled by passing 'output_dir': only every
+    'every'-th call or a random 'fraction' of calls (default: all) is profiled. The samples of all
+    profiled calls are merged into one session and written as reports ('html', 'json', 'speedscope'
+    and/or 'text') to 'output_dir' at interpreter exit, or on demand via wrapper.write_reports().
+    Works for coroutine functions and is thread-safe.
+    Passing 'every', 'fraction' or 'formats' without 'output_dir' raises a ValueError.
     """
+    if func is None:
+        return functools.partial(
+            profile,
+            every=every,
+            fraction=fraction,
+            output_dir=output_dir,
+            formats=formats,
+            interval=interval,
+        )
+
+    if output_dir is None:
+        if every is not None or fraction is not None or tuple(formats) != ("html",):
+            raise ValueError(
+                "'every', 'fraction' and 'formats' need an 'output_dir' to write the reports to."
+            )
+        return _profile_in_browser(func)
+
+    from pyinstrument import Profiler
+
+    sampled = SampledProfile(func.__qualname__, output_dir, every, fraction, formats)
+    atexit.register(sampled.write_reports)
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if not sampled.should_profile():
+                return await func(*args, **kwargs)
+            profiler = Profiler(interval=interval, async_mode="enabled")
+            profiler.start()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                sampled.add(profiler.stop())
+
+        async_wrapper.write_reports = sampled.write_reports
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not sampled.should_profile():
+            return func(*args, **kwargs)
+        profiler = Profiler(interval=interval, async_mode="disabled")
+        profiler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampled.add(profiler.stop())
+
+    wrapper.write_reports = sampled.write_reports
+    return wrapper
+
+
+def _profile_in_browser(func):
+    from pyinstrument import Profiler
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
@@ -68,10 +229,188 @@ def execute_if_older(file_to_check: Path, days: int = 1):
     return decorator
 
 
+def _hash_code(h, code) -> None:
+    h.update(code.co_code)
+    # co_code only holds indices into these, e.g. len(x) and sum(x) have the same bytecode
+    for names in (code.co_names, code.co_varnames, code.co_freevars, code.co_cellvars):
+        h.update(repr(names).encode())
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            _hash_code(h, const)
+        else:
+            h.update(repr(const).encode())
+
+
+def _hash_value(h, value: Any) -> None:
+    """
+    Feeds 'value' into hash 'h', the same in every process. DataFrames/Series are hashed with
+    pandas' vectorized row hashing and NumPy arrays via their raw buffer. pandas/numpy are only
+    imported if such a value is passed.
+    Sets are hashed by their sorted element digests, as their iteration order depends on the hash
+    seed.
+    Other objects are not pickled (that might fail, or depend on the process), but raise a
+    TypeError; pass 'key' to memoize for them.
+    """
+    h.update(type(value).__qualname__.encode())
+    module = type(value).__module__
+    if isinstance(value, (str, bytes, int, float, complex, bool, type(None))):
+        h.update(repr(value).encode())
+    elif isinstance(value, (list, tuple)):
+        h.update(str(len(value)).encode())
+        for v in value:
+            _hash_value(h, v)
+    elif isinstance(value, dict):
+        h.update(str(len(value)).encode())
+        for k, v in value.items():
+            _hash_value(h, k)
+            _hash_value(h, v)
+    elif isinstance(value, (set, frozenset)):
+        digests = []
+        for v in value:
+            element_hash = hashlib.blake2b()
+            _hash_value(element_hash, v)
+            digests.append(element_hash.digest())
+        h.update(b"".join(sorted(digests)))
+    elif isinstance(value, (PurePath, datetime.date, datetime.time, datetime.timedelta, Enum)):
+        h.update(repr(value).encode())
+    elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+        for f in dataclasses.fields(value):
+            _hash_value(h, f.name)
+            _hash_value(h, getattr(value, f.name))
+    elif module.startswith("pandas") and type(value).__name__ in ("DataFrame", "Series"):
+        import pandas as pd
+
+        h.update(repr(value.columns if isinstance(value, pd.DataFrame) else value.name).encode())
+        h.update(repr(value.dtypes).encode())
+        h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif module == "numpy" and hasattr(value, "dtype") and hasattr(value, "shape"):
+        import numpy as np
+
+        h.update(f"{value.dtype}{value.shape}".encode())
+        if value.dtype.hasobject:
+            _hash_value(h, value.tolist())
+        else:
+            h.update(np.ascontiguousarray(value).data)
+    else:
+        raise TypeError(
+            f"Can't hash an argument of type {type(value).__qualname__} for memoize, pass 'key' "
+            f"to map the arguments to hashable values, e.g. key=lambda self, x: x for a method."
+        )
+
+
+def memoize(
+    cache_dir: Optional[Path] = None,
+    ttl: Optional[float] = None,
+    max_entries: int = 128,
+    max_disk_entries: Optional[int] = None,
+    key: Optional[Callable] = None,
+):
+    """
+    Caches the results of the decorated function, keyed by a hash of the function's code and its
+    arguments (DataFrames and arrays are hashed by content). Results are kept in an in-memory LRU
+    cache of 'max_entries' and, if 'cache_dir' is given, on disk in the 'pickle5' format of
+    'save_structure' (loaded memory-mapped).
+    Entries older than 'ttl' seconds are recomputed. If 'max_disk_entries' is set, the least
+    recently used files are deleted once more are stored.
+    Disk entries are written to a temporary file and renamed into place, so multiple processes can
+    share a 'cache_dir' safely; at worst, a result is computed by more than one of them.
+    Arguments have to be built-in values, sets, paths, dates, enums, dataclasses, DataFrames/Series
+    or arrays.
+    For other arguments (e.g. 'self' of a method), pass 'key', a function that is called with the
+    arguments and returns the values to hash instead.
+    Can be used with or without arguments: @memoize or @memoize(cache_dir=...).
+    """
+    if callable(cache_dir):
+        return memoize()(cache_dir)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        code_hash = hashlib.blake2b(func.__qualname__.encode())
+        _hash_code(code_hash, func.__code__)
+        memory: "OrderedDict[str, tuple]" = OrderedDict()
+        lock = threading.Lock()
+
+        def _key(args, kwargs) -> str:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            h = code_hash.copy()
+            _hash_value(h, bound.arguments if key is None else key(*args, **kwargs))
+            return f"{func.__name__}_{h.hexdigest()[:32]}"
+
+        def _load_from_disk(key: str):
+            file_path = cache_dir / f"{key}.pkl5"
+            try:
+                stat = os.stat(file_path)
+                if ttl is not None and time.time() - stat.st_mtime > ttl:
+                    return None
+                result = _load_pickle5(file_path)
+                # atime marks the last use for LRU eviction, mtime stays the creation time for the
+                # TTL
+                os.utime(file_path, (time.time(), stat.st_mtime))
+            except (FileNotFoundError, ValueError, EOFError, pickle.UnpicklingError):
+                return None
+            return stat.st_mtime, result
+
+        def _save_to_disk(key: str, result) -> None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            file_path = cache_dir / f"{key}.pkl5"
+            tmp_path = cache_dir / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                _dump_pickle5(result, f, None)
+            os.replace(tmp_path, file_path)
+
+            if max_disk_entries is not None:
+                with os.scandir(cache_dir) as it:
+                    entries = [e for e in it if e.name.endswith(".pkl5")]
+                if len(entries) > max_disk_entries:
+                    entries.sort(key=lambda e: e.stat().st_atime)
+                    for e in entries[: len(entries) - max_disk_entries]:
+                        try:
+                            os.unlink(e.path)
+                        except FileNotFoundError:
+                            pass
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = _key(args, kwargs)
+            with lock:
+                if key in memory:
+                    created, result = memory[key]
+                    if ttl is None or time.time() - created <= ttl:
+                        memory.move_to_end(key)
+                        return result
+                    del memory[key]
+
+            cached = _load_from_disk(key) if cache_dir is not None else None
+            if cached is not None:
+                created, result = cached
+            else:
+                created, result = time.time(), func(*args, **kwargs)
+                if cache_dir is not None:
+                    _save_to_disk(key, result)
+
+            with lock:
+                memory[key] = (created, result)
+                while len(memory) > max_entries:
+                    memory.popitem(last=False)
+            return result
+
+        def cache_clear():
+            with lock:
+                memory.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
+
+
 def line_profile(function):
     @wraps(function)
     def wrapper(*args, **kwargs):
         try:
+            from line_profiler import LineProfiler
+
             profiler = LineProfiler(function)
             profiler.enable_by_count()
             result = function(*args, **kwargs)
@@ -84,11 +423,183 @@ def line_profile(function):
     return wrapper
 
 
-def time_execution(function):
+_SUB_BITS = 3  # 8 sub-buckets per power of two, i.e. percentiles are accurate to ~12%
+
+
+def _bucket_lower_bound(i: int) -> int:
+    if i < 1 << _SUB_BITS:
+        return i
+    e = (i >> _SUB_BITS) + _SUB_BITS
+    return ((i & ((1 << _SUB_BITS) - 1)) + (1 << _SUB_BITS)) << (e - _SUB_BITS - 1)
+
+
+class _TimingStats:
+    __slots__ = ("total_ns", "max_ns", "buckets")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * (64 << _SUB_BITS)
+
+    @property
+    def count(self) -> int:
+        # derived from the histogram, so recording a call updates one counter less
+        return sum(self.buckets)
+
+    def record(self, ns: int) -> None:
+        # log-linear histogram bucket: exponent and the next 3 bits of the duration. Clamping the
+        # exponent to 4 makes the same formula give the exact bucket ns below 8ns, without a branch.
+        e = ns.bit_length()
+        if e < 4:
+            e = 4
+        self.buckets[((e - 3) << 3) + (ns >> (e - 4)) - 8] += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, q: float) -> float:
+        """Approximate q-th percentile in seconds (midpoint of the histogram bucket)."""
+        count = self.count
+        if not count:
+            return float("nan")
+        target = q / 100 * count
+        cumulative = 0
+        for i, n in enumerate(self.buckets):
+            cumulative += n
+            if n and cumulative >= target:
+                return (_bucket_lower_bound(i) + _bucket_lower_bound(i + 1)) / 2 / 1e9
+        return self.max_ns / 1e9
+
+
+class TimingRegistry:
+    """
+    Collects call counts, total time and latency histograms of functions decorated with
+    'time_execution'.
+    Recording is lock-free; under heavy multi-threaded contention single counts might be lost.
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, _TimingStats] = {}
+        self._exporter: Optional[threading.Thread] = None
+        self._stop_export = threading.Event()
+
+    def get(self, name: str) -> _TimingStats:
+        if name not in self._stats:
+            self._stats[name] = _TimingStats()
+        return self._stats[name]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Returns {name: {count, total_s, mean_s, p50_s, p95_s, p99_s, max_s}} per function."""
+        return {
+            name: {
+                "count": (count := s.count),
+                "total_s": s.total_ns / 1e9,
+                "mean_s": s.total_ns / count / 1e9 if count else float("nan"),
+                "p50_s": s.percentile(50),
+                "p95_s": s.percentile(95),
+                "p99_s": s.percentile(99),
+                "max_s": s.max_ns / 1e9,
+            }
+            for name, s in list(self._stats.items())
+        }
+
+    def dump(self, path: Optional[Path] = None) -> None:
+        """Writes the snapshot as JSON to 'path', or logs it if no path is given."""
+        snapshot = self.snapshot()
+        if path is None:
+            for name, stats in snapshot.items():
+                logger.info(
+                    f"{name}: {stats['count']} calls, {stats['total_s']:.3f}s total, "
+                    f"p50 {stats['p50_s'] * 1e3:.3f}ms, p95 {stats['p95_s'] * 1e3:.3f}ms, "
+                    f"p99 {stats['p99_s'] * 1e3:.3f}ms"
+                )
+            return
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(snapshot, indent=2))
+        os.replace(tmp_path, path)
+
+    def export_every(self, interval: float, path: Optional[Path] = None) -> None:
+        """Calls 'dump(path)' every 'interval' seconds in a daemon thread until 'stop_export'."""
+        self.stop_export()
+        self._stop_export.clear()
+
+        def _run():
+            while not self._stop_export.wait(interval):
+                self.dump(path)
+
+        self._exporter = threading.Thread(target=_run, name="timing_export", daemon=True)
+        self._exporter.start()
+
+    def stop_export(self) -> None:
+        if self._exporter is not None:
+            self._stop_export.set()
+            self._exporter.join()
+            self._exporter = None
+
+    def reset(self) -> None:
+        # decorated functions hold on to their _TimingStats, so they are zeroed in place instead of
+        # dropped
+        for stats in list(self._stats.values()):
+            stats.reset()
+
+
+TIMINGS = TimingRegistry()
+
+
+def time_execution(
+    function=None,
+    *,
+    name: Optional[str] = None,
+    registry: TimingRegistry = TIMINGS,
+    verbose: bool = False,
+):
+    """
+    Records the duration of every call of the decorated function (or coroutine function) in
+    'registry' (default: TIMINGS), use TIMINGS.snapshot(), TIMINGS.dump() or TIMINGS.export_every()
+    to inspect the results.
+    The overhead is two clock reads and a histogram update per call, see
+    benchmarks/timing_overhead.py.
+    Set 'verbose' to also print every call.
+    Can be used with or without arguments: @time_execution or @time_execution(verbose=True).
+    Calls are recorded under 'name', by default "<module>.<qualname>" of the function.
+    """
+    if function is None:
+        return functools.partial(time_execution, name=name, registry=registry, verbose=verbose)
+
+    record = registry.get(name or f"{function.__module__}.{function.__qualname__}").record
+    if verbose:
+        record = _print_duration(record, function.__name__)
+
+    # the hot path only reads the clock twice and updates the histogram
+    if inspect.iscoroutinefunction(function):
+
+        @wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                record(perf_counter_ns() - start)
+
+        return async_wrapper
+
     @wraps(function)
     def wrapper(*args, **kwargs):
-        start = timer()
-        result = function(*args, **kwargs)
-        end = timer()
+        start = perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(perf_counter_ns() - start)
+
+    return wrapper
+
+
+def _print_duration(record: Callable[[int], None], function_name: str) -> Callable[[int], None]:
+    def record_and_print(duration: int) -> None:
+        record(duration)
+        print(f"'{function_name}' took {round(duration / 1e9, 3)}s to execute.")
 
-        print(f"'{function.__name__}' took {round(end - start, 3)}s to execute.")
+    return record_and_print
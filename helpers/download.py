@@ -1,13 +1,25 @@
-from typing import Dict
+from typing import AsyncIterator, Collection, Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from timeit import default_timer as timer
 import asyncio
+import contextlib
+import hashlib
+import itertools
+import os
+import random
+import sqlite3
+import time
 import httpx
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from loguru import logger
-from PIL import Image, UnidentifiedImageError
+from PIL import Image
 
-__all__ = ["download_images_from_df"]
+__all__ = ["download_images_from_df", "download_images_from_chunks", "RetryPolicy", "HostLimiter"]
 
 
 async def download_images_from_df(
@@ -16,73 +28,747 @@ async def download_images_from_df(
     url_column_name: str = "url",
     file_column_name: str = "image_file",
     semaphore_counter: int = 50,
+    max_connections_per_host: Optional[int] = None,
+    http2: bool = False,
+    keepalive_expiry: float = 30.0,
+    stream: bool = False,
+    chunk_size: int = 64 * 1024,
+    max_body_size: Optional[int] = None,
+    journal_path: Optional[Path] = None,
+    verify_workers: Optional[int] = None,
+    thumbnail_size: Optional[Tuple[int, int]] = None,
+    convert_format: Optional[str] = None,
+    retry_policy: Optional["RetryPolicy"] = None,
+    host_limiter: Optional["HostLimiter"] = None,
 ) -> pd.DataFrame:
     """
     Method for asynchronous download of all images specified in a pandas Dataframe.
+    'semaphore_counter' workers pull rows from a bounded queue, so memory stays flat regardless of
+    the number of rows. Returns a shallow copy of 'df' with the columns 'downloaded', 'correct_tag',
+    'status_code', 'bytes' and 'latency' (seconds for the whole download) added.
+    All rows share one pooled client, so TCP/TLS connections are kept alive and reused across
+    downloads.
+    Set 'max_connections_per_host' to additionally cap the number of concurrent requests per host.
+    'http2=True' requires the 'h2' package (pip install httpx[http2]).
+    With 'stream=True', bodies are written to disk in chunks of 'chunk_size' bytes instead of being
+    buffered.
+    In both modes, responses larger than 'max_body_size' bytes are aborted, and bodies are written
+    to a '.part' file that is renamed into place once complete.
+    Provide 'journal_path' to make the job resumable: completed downloads are recorded with size and
+    checksum in a SQLite journal, and a restarted job skips them if the file still exists with the
+    recorded size (one directory listing per job). Files that are not in the journal are
+    (re)downloaded, even if they exist on disk, as they might be truncated.
+    Downloaded images are verified (and optionally shrunk to 'thumbnail_size' and/or re-encoded in
+    place as 'convert_format', e.g. "JPEG") in a pool of 'verify_workers' processes, fed through a
+    bounded queue.
+    Images that fail to decode are deleted and reported with 'correct_tag' False.
+    Failed requests are retried according to 'retry_policy' (exponential backoff with jitter,
+    honoring Retry-After). Pass a 'host_limiter' for per-host rate limits and adaptive concurrency
+    caps, it replaces 'max_connections_per_host'. Per-host request, retry and throttling counters
+    are available from host_limiter.stats() afterwards, e.g. with HostLimiter(max_per_host=...) to
+    keep the default limits.
+    For manifests that do not fit into memory, use download_images_from_chunks.
     """
 
-    _df = df.copy(deep=True)
-    coroutines = [
-        cor_download_single(
-            r,
-            download_dir,
-            url_column_name,
-            file_column_name,
+    results = [
+        result
+        async for result in download_images_from_chunks(
+            [df],
+            download_dir=download_dir,
+            url_column_name=url_column_name,
+            file_column_name=file_column_name,
+            semaphore_counter=semaphore_counter,
+            max_connections_per_host=max_connections_per_host,
+            http2=http2,
+            keepalive_expiry=keepalive_expiry,
+            stream=stream,
+            chunk_size=chunk_size,
+            max_body_size=max_body_size,
+            journal_path=journal_path,
+            verify_workers=verify_workers,
+            thumbnail_size=thumbnail_size,
+            convert_format=convert_format,
+            retry_policy=retry_policy,
+            host_limiter=host_limiter,
         )
-        for _, r in _df.iterrows()
     ]
-    sem = asyncio.Semaphore(semaphore_counter)
+    return results[0]
 
-    async def _sem_wrap(coro):
-        async with sem:
-            return await coro
 
-    results = await asyncio.gather(*[_sem_wrap(c) for c in coroutines])
-    return pd.DataFrame(results)
-
-
-async def cor_download_single(
-    row: pd.Series,
+async def download_images_from_chunks(
+    chunks: Iterable[pd.DataFrame],
     download_dir: Path,
     url_column_name: str = "url",
     file_column_name: str = "image_file",
-) -> Dict:
-    row["downloaded"] = False
-    row["correct_tag"] = True
+    semaphore_counter: int = 50,
+    max_connections_per_host: Optional[int] = None,
+    http2: bool = False,
+    keepalive_expiry: float = 30.0,
+    stream: bool = False,
+    chunk_size: int = 64 * 1024,
+    max_body_size: Optional[int] = None,
+    journal_path: Optional[Path] = None,
+    verify_workers: Optional[int] = None,
+    thumbnail_size: Optional[Tuple[int, int]] = None,
+    convert_format: Optional[str] = None,
+    retry_policy: Optional["RetryPolicy"] = None,
+    host_limiter: Optional["HostLimiter"] = None,
+) -> AsyncIterator[pd.DataFrame]:
+    """
+    Like download_images_from_df, for manifests that do not fit into memory, e.g. read with
+    helpers.read_chunks: yields one result DataFrame per chunk as soon as all of its rows are
+    downloaded and verified. All chunks share the client, verify pool, host limiter and journal. The
+    next chunk is read in a thread, so reading does not block the downloads.
+    """
+    host_limiter = host_limiter or HostLimiter(max_connections_per_host)
+    verify_workers = verify_workers or os.cpu_count() or 1
+    journal = DownloadJournal(journal_path) if journal_path is not None else None
+    completed = _on_disk(journal.completed(), download_dir) if journal is not None else {}
+
+    async def _run(
+        df: pd.DataFrame, client: httpx.AsyncClient, pool: ProcessPoolExecutor
+    ) -> pd.DataFrame:
+        n = len(df)
+        downloaded = np.zeros(n, dtype=bool)
+        correct_tag = np.ones(n, dtype=bool)
+        status_code = np.zeros(n, dtype=np.int16)
+        n_bytes = np.zeros(n, dtype=np.int64)
+        latency = np.full(n, np.nan, dtype=np.float32)
+
+        urls = df[url_column_name].to_numpy()
+        file_names = df[file_column_name].to_numpy()
+        if "accommodation_code" in df:
+            log_names = df["accommodation_code"].to_numpy()
+        else:
+            log_names = itertools.repeat("Unknown", n)
+
+        queue = asyncio.Queue(maxsize=2 * semaphore_counter)
+        verify_queue = asyncio.Queue(maxsize=2 * verify_workers)
+
+        async def _produce():
+            for item in enumerate(zip(urls, file_names, log_names)):
+                i, (url, file_name, _) = item
+                if (entry := completed.get(file_name)) is not None and entry[0] == url:
+                    downloaded[i] = True
+                    n_bytes[i] = entry[1]
+                    continue
+                await queue.put(item)
+            for _ in range(semaphore_counter):
+                await queue.put(None)
+
+        async def _work(client: httpx.AsyncClient):
+            while (item := await queue.get()) is not None:
+                i, (url, file_name, log_name) = item
+                res = await cor_download_single(
+                    url,
+                    download_dir / file_name if isinstance(file_name, str) else None,
+                    client=client,
+                    host_limiter=host_limiter,
+                    stream=stream,
+                    chunk_size=chunk_size,
+                    max_body_size=max_body_size,
+                    log_name=log_name,
+                    skip_existing=journal is None,
+                    checksum=journal is not None,
+                    verify=False,
+                    retry_policy=retry_policy,
+                )
+                status_code[i] = res.status_code
+                n_bytes[i] = res.n_bytes
+                latency[i] = res.latency
+                if res.downloaded and not res.existing:
+                    await verify_queue.put((i, file_name, url, res.checksum))
+                else:
+                    downloaded[i] = res.downloaded
+
+        async def _download_stage():
+            await asyncio.gather(*[_work(client) for _ in range(semaphore_counter)])
+            for _ in range(verify_workers):
+                await verify_queue.put(None)
+
+        async def _verify():
+            loop = asyncio.get_running_loop()
+            while (item := await verify_queue.get()) is not None:
+                i, file_name, url, checksum = item
+                ok = await loop.run_in_executor(
+                    pool, verify_image, download_dir / file_name, thumbnail_size, convert_format
+                )
+                downloaded[i] = correct_tag[i] = ok
+                if not ok:
+                    logger.info(f"Bad downloaded image {file_name} found and deleted.")
+                elif journal is not None:
+                    # the size on disk is checked when the job is restarted, it changes if the image
+                    # was rewritten
+                    size = n_bytes[i]
+                    if thumbnail_size is not None or convert_format is not None:
+                        size = await loop.run_in_executor(
+                            None, os.path.getsize, download_dir / file_name
+                        )
+                    journal.record(file_name, url, size, checksum)
+
+        tasks = [asyncio.ensure_future(_produce()), asyncio.ensure_future(_download_stage())]
+        tasks += [asyncio.ensure_future(_verify()) for _ in range(verify_workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+
+        result = df.copy(deep=False)
+        result["downloaded"] = downloaded
+        result["correct_tag"] = correct_tag
+        result["status_code"] = status_code
+        result["bytes"] = n_bytes
+        result["latency"] = latency
+        return result
+
+    chunks = iter(chunks)
+    loop = asyncio.get_running_loop()
+    async with create_client(semaphore_counter, http2, keepalive_expiry) as client:
+        pool = ProcessPoolExecutor(max_workers=verify_workers)
+        try:
+            while (chunk := await loop.run_in_executor(None, next, chunks, None)) is not None:
+                yield await _run(chunk, client, pool)
+        finally:
+            pool.shutdown(cancel_futures=True)
+            if journal is not None:
+                journal.close()
+
+
+def create_client(
+    max_connections: int = 50, http2: bool = False, keepalive_expiry: float = 30.0
+) -> httpx.AsyncClient:
+    """
+    Creates the pooled client shared by all downloads of a job. The pool is sized to the number of
+    concurrent downloads, so every in-flight request can keep its connection alive.
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return httpx.AsyncClient(limits=limits, http2=http2, timeout=2)
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Retry behaviour of a single download. The n-th retry waits a random time between 0 and
+    min(max_delay, base_delay * multiplier ** n) ("full jitter"), or 'Retry-After' seconds if the
+    server sent the header. Responses with a status code in 'retry_statuses' are retried instead of
+    written to disk.
+    """
+
+    max_attempts: int = 3
+    base_delay: float = 0.3
+    multiplier: float = 2.0
+    max_delay: float = 30.0
+    jitter: bool = True
+    timeout: float = 2.0
+    retry_statuses: Collection[int] = (429, 500, 502, 503, 504)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        delay = min(self.max_delay, self.base_delay * self.multiplier**attempt)
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+class RetryableStatusError(Exception):
+    def __init__(self, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(f"Status {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header, which is either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _check_status(r: httpx.Response, retry_statuses: Collection[int]) -> None:
+    if r.status_code in retry_statuses:
+        raise RetryableStatusError(r.status_code, _parse_retry_after(r.headers.get("Retry-After")))
+
+
+class _HostState:
+    def __init__(self, limiter: "HostLimiter"):
+        self.limiter = limiter
+        self.limit = limiter.max_per_host
+        self.rate = limiter.rate_per_host
+        self.tokens = limiter.burst
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self._released: Optional[asyncio.Condition] = None
+        self._released_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+        self.latency_ewma = float("nan")
+        self.min_latency = float("inf")
+
+    async def acquire(self) -> None:
+        start = time.monotonic()
+        waited = False
+
+        # Retry-After of an earlier response pauses the whole host
+        while (pause := self.paused_until - time.monotonic()) > 0:
+            waited = True
+            await asyncio.sleep(pause)
+
+        # token bucket
+        while self.rate is not None:
+            now = time.monotonic()
+            self.tokens = min(
+                self.limiter.burst, self.tokens + (now - self.last_refill) * self.rate
+            )
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                break
+            waited = True
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+        # concurrency cap
+        if self.limit is not None and self.in_flight >= int(self.limit):
+            waited = True
+            released = self._condition()
+            async with released:
+                await released.wait_for(lambda: self.in_flight < int(self.limit))
+
+        self.in_flight += 1
+        self.requests += 1
+        if waited:
+            self.throttled += 1
+            self.wait_time += time.monotonic() - start
+
+    async def release(self) -> None:
+        self.in_flight -= 1
+        released = self._condition()
+        async with released:
+            released.notify_all()
+
+    def _condition(self) -> asyncio.Condition:
+        # a Condition is bound to the event loop it is first used in, the limiter (and its counters)
+        # can be reused across jobs that each run in their own loop, e.g. with asyncio.run
+        loop = asyncio.get_running_loop()
+        if self._released_loop is not loop:
+            self._released, self._released_loop = asyncio.Condition(), loop
+        return self._released
+
+    def on_success(self, latency: float) -> None:
+        self.successes += 1
+        self.min_latency = min(self.min_latency, latency)
+        if self.latency_ewma != self.latency_ewma:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = 0.9 * self.latency_ewma + 0.1 * latency
+
+        if not self.limiter.adaptive:
+            return
+        if latency > self.limiter.latency_tolerance * self.min_latency:
+            self._decrease(0.9)
+            return
+        if self.limit is not None:
+            self.limit = min(self.limiter.max_per_host, self.limit + 1 / self.limit)
+        if self.rate is not None:
+            self.rate = min(self.limiter.rate_per_host, self.rate * 1.05)
+
+    def on_failure(self, retry_after: Optional[float] = None) -> None:
+        self.errors += 1
+        if retry_after is not None:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        if self.limiter.adaptive:
+            self._decrease(0.5)
+
+    def _decrease(self, factor: float) -> None:
+        # decrease at most once per observed round trip, concurrent failures belong to the same
+        # congestion event
+        now = time.monotonic()
+        if now - self.last_decrease < (
+            self.latency_ewma if self.latency_ewma == self.latency_ewma else 0
+        ):
+            return
+        self.last_decrease = now
+        if self.limit is not None:
+            self.limit = max(self.limiter.min_per_host, self.limit * factor)
+        if self.rate is not None:
+            self.rate = max(self.limiter.min_rate, self.rate * factor)
+
+
+class HostLimiter:
+    """
+    Per-host request limits. 'max_per_host' caps concurrent requests, 'rate_per_host' (requests per
+    second, with bursts of up to 'burst') is enforced with a token bucket. None disables the
+    respective limit.
+    With 'adaptive', both limits are lowered multiplicatively on errors and when the latency (time
+    until the response headers arrive, so independent of the body size) rises above
+    'latency_tolerance' times the fastest observed response, and raised additively on fast successes
+    (never above the configured values). A Retry-After header pauses all requests to the host.
+    """
+
+    def __init__(
+        self,
+        max_per_host: Optional[int] = None,
+        rate_per_host: Optional[float] = None,
+        burst: int = 1,
+        adaptive: bool = False,
+        min_per_host: int = 1,
+        min_rate: float = 0.1,
+        latency_tolerance: float = 3.0,
+    ):
+        self.max_per_host = max_per_host
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.adaptive = adaptive
+        self.min_per_host = min_per_host
+        self.min_rate = min_rate
+        self.latency_tolerance = latency_tolerance
+        self._hosts: Dict[str, _HostState] = {}
+
+    def host(self, url: str) -> _HostState:
+        host = httpx.URL(url).host
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(self)
+        return self._hosts[host]
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, url: str):
+        state = self.host(url)
+        await state.acquire()
+        try:
+            yield state
+        finally:
+            await state.release()
+
+    def stats(self) -> pd.DataFrame:
+        return pd.DataFrame.from_dict(
+            {
+                host: {
+                    "requests": s.requests,
+                    "successes": s.successes,
+                    "errors": s.errors,
+                    "retries": s.retries,
+                    "throttled": s.throttled,
+                    "wait_time": s.wait_time,
+                    "concurrency_limit": s.limit,
+                    "rate": s.rate,
+                    "latency_ewma": s.latency_ewma,
+                }
+                for host, s in self._hosts.items()
+            },
+            orient="index",
+        ).rename_axis("host")
+
+
+class DownloadJournal:
+    """
+    Append-only SQLite journal of completed downloads, keyed by file name. Records are buffered and
+    committed every 'commit_every' records, so at most that many completed downloads are lost when
+    the job is killed.
+    """
+
+    def __init__(self, path: Path, commit_every: int = 100):
+        self.path = path
+        self.commit_every = commit_every
+        self._pending = []
+        self._con = sqlite3.connect(path)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS completed "
+            "(file_name TEXT PRIMARY KEY, url TEXT, size INTEGER, sha256 TEXT, completed_at REAL)"
+        )
+        self._con.commit()
+
+    def completed(self) -> Dict[str, Tuple[str, int, str]]:
+        """Returns {file_name: (url, size, sha256)} for all recorded downloads."""
+        rows = self._con.execute("SELECT file_name, url, size, sha256 FROM completed")
+        return {file_name: (url, size, sha256) for file_name, url, size, sha256 in rows}
+
+    def record(self, file_name: str, url: str, size: int, sha256: Optional[str]) -> None:
+        self._pending.append((file_name, url, int(size), sha256, time.time()))
+        if len(self._pending) >= self.commit_every:
+            self.commit()
+
+    def commit(self) -> None:
+        if self._pending:
+            self._con.executemany(
+                "INSERT OR REPLACE INTO completed VALUES (?, ?, ?, ?, ?)", self._pending
+            )
+            self._con.commit()
+            self._pending = []
+
+    def close(self) -> None:
+        self.commit()
+        self._con.close()
+
+
+def _on_disk(
+    completed: Dict[str, Tuple[str, int, str]], download_dir: Path
+) -> Dict[str, Tuple[str, int, str]]:
+    """
+    Drops journal entries whose file is missing in 'download_dir' or has a different size than
+    recorded, so deleted or truncated files are downloaded again. Lists the directory once, only the
+    files that are in the journal are stat'ed.
+    """
+    try:
+        with os.scandir(download_dir) as it:
+            entries = {e.name: e for e in it}
+    except FileNotFoundError:
+        return {}
+
+    def _size(file_name: str) -> Optional[int]:
+        try:
+            if file_name in entries:
+                return entries[file_name].stat().st_size
+            # file names with subdirectories are not in the listing
+            return os.stat(download_dir / file_name).st_size if os.sep in file_name else None
+        except OSError:
+            return None
+
+    return {name: entry for name, entry in completed.items() if _size(name) == entry[1]}
+
 
-    accommodation_code = row["accommodation_code"] if "accommodation_code" in row else "Unknown"
-    file_name = row[file_column_name]
+def verify_image(
+    pth: Path,
+    thumbnail_size: Optional[Tuple[int, int]] = None,
+    convert_format: Optional[str] = None,
+) -> bool:
+    """
+    Verifies that 'pth' is a decodable image and deletes it if not. Optionally shrinks the image in
+    place to fit 'thumbnail_size' and/or re-encodes it as 'convert_format'. Module-level, so it can
+    run in a process pool.
+    """
+    try:
+        with Image.open(pth) as img:
+            img.verify()
+        if thumbnail_size is not None or convert_format is not None:
+            # verify() leaves the image unusable, it has to be reopened for decoding
+            with Image.open(pth) as img:
+                img.load()
+                out_format = convert_format or img.format
+                if thumbnail_size is not None:
+                    img.thumbnail(thumbnail_size)
+                if out_format.upper() in ("JPEG", "JPG") and img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+                img.save(pth, format=out_format)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        pth.unlink(missing_ok=True)
+        return False
+    return True
+
+
+class BodyTooLargeError(Exception):
+    pass
+
+
+def _write_and_hash(f, chunk: bytes, hasher=None) -> None:
+    f.write(chunk)
+    if hasher is not None:
+        hasher.update(chunk)
+
+
+def _write_body(pth: Path, chunks: List[bytes], hasher=None) -> None:
+    with open(pth, "wb") as f:
+        for chunk in chunks:
+            _write_and_hash(f, chunk, hasher)
+
+
+async def _download_to_file(
+    client: httpx.AsyncClient,
+    url: str,
+    pth: Path,
+    stream: bool = False,
+    chunk_size: int = 64 * 1024,
+    max_body_size: Optional[int] = None,
+    checksum: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+) -> Tuple[int, int, Optional[str], float]:
+    """
+    Downloads the response body into a temporary '.part' file and atomically renames it to 'pth'
+    once complete, so 'pth' never holds a truncated download. With 'stream', the body is written in
+    chunks of 'chunk_size' bytes while it is received, otherwise it is buffered and written at once.
+    In both modes, bodies larger than 'max_body_size' bytes raise BodyTooLargeError. All file
+    operations run in the default thread pool. Raises RetryableStatusError before writing anything
+    if the status code should be retried.
+    Returns the response status code, the number of bytes written, the sha256 hex digest if
+    'checksum' is set and the time until the response headers arrived in seconds (unlike the full
+    download time, independent of the body size and the disk).
+    """
+    loop = asyncio.get_running_loop()
+    retry_policy = retry_policy or RetryPolicy()
+    tmp_pth = pth.with_name(pth.name + ".part")
+    hasher = hashlib.sha256() if checksum else None
+    size = 0
+
+    try:
+        start = timer()
+        async with client.stream("GET", url, timeout=retry_policy.timeout) as r:
+            headers_latency = timer() - start
+            _check_status(r, retry_policy.retry_statuses)
+            content_length = r.headers.get("Content-Length")
+            if max_body_size is not None and content_length and int(content_length) > max_body_size:
+                raise BodyTooLargeError(
+                    f"Content-Length {content_length} exceeds {max_body_size} bytes."
+                )
 
-    # simple way to retry failed downloads
-    for i in range(3):
-        if row["downloaded"]:
+            chunks = []
+            f = await loop.run_in_executor(None, open, tmp_pth, "wb") if stream else None
+            try:
+                async for chunk in r.aiter_bytes(chunk_size if stream else None):
+                    size += len(chunk)
+                    if max_body_size is not None and size > max_body_size:
+                        raise BodyTooLargeError(f"Body exceeds {max_body_size} bytes.")
+                    if stream:
+                        await loop.run_in_executor(None, _write_and_hash, f, chunk, hasher)
+                    else:
+                        chunks.append(chunk)
+            finally:
+                if f is not None:
+                    await loop.run_in_executor(None, f.close)
+        if not stream:
+            await loop.run_in_executor(None, _write_body, tmp_pth, chunks, hasher)
+        await loop.run_in_executor(None, os.replace, tmp_pth, pth)
+    except BaseException:
+        await loop.run_in_executor(None, lambda: tmp_pth.unlink(missing_ok=True))
+        raise
+
+    return r.status_code, size, hasher.hexdigest() if hasher is not None else None, headers_latency
+
+
+@dataclass
+class DownloadResult:
+    downloaded: bool = False
+    correct_tag: bool = True
+    status_code: int = 0
+    n_bytes: int = 0
+    latency: float = float("nan")
+    checksum: Optional[str] = None
+    existing: bool = False
+
+
+async def cor_download_single(
+    url: str,
+    pth: Optional[Path],
+    client: Optional[httpx.AsyncClient] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    stream: bool = False,
+    chunk_size: int = 64 * 1024,
+    max_body_size: Optional[int] = None,
+    log_name: str = "Unknown",
+    skip_existing: bool = True,
+    checksum: bool = False,
+    verify: bool = True,
+    retry_policy: Optional[RetryPolicy] = None,
+) -> DownloadResult:
+    """
+    Downloads 'url' to 'pth'. Pass the job's shared 'client', otherwise a temporary one is created.
+    With 'skip_existing', an existing file at 'pth' counts as downloaded. With 'checksum', the
+    sha256 of the body is computed while writing it. With 'verify', the image is verified in the
+    default thread pool and the download retried if it can't be decoded; set it to False if
+    verification happens downstream.
+    Request errors and retryable status codes are retried according to 'retry_policy'.
+    """
+    if client is None:
+        async with create_client(max_connections=1) as client:
+            return await cor_download_single(
+                url,
+                pth,
+                client,
+                host_limiter,
+                stream,
+                chunk_size,
+                max_body_size,
+                log_name,
+                skip_existing,
+                checksum,
+                verify,
+                retry_policy,
+            )
+    host_limiter = host_limiter or HostLimiter()
+    retry_policy = retry_policy or RetryPolicy()
+    res = DownloadResult()
+
+    if pth is None:
+        logger.info(f"{log_name}: Found invalid file name for url {url}")
+        return res
+
+    for attempt in range(retry_policy.max_attempts):
+        if res.downloaded:
             break
-        if i > 0:
-            logger.info(f"{accommodation_code}: Download round {i+1}")
+        if attempt > 0:
+            logger.info(f"{log_name}: Download round {attempt+1}")
 
-        _pth = download_dir.joinpath(file_name)
-        if _pth.is_file():
-            row["downloaded"] = True
-            return row.to_dict()
+        if skip_existing and pth.is_file():
+            res.downloaded = res.existing = True
+            return res
         try:
-            async with httpx.AsyncClient() as client:
-                r = await client.get(row[url_column_name], timeout=2)
-                with open(_pth, "wb") as f:
-                    f.write(r.content)
-            row["downloaded"] = True
+            async with host_limiter(url) as host:
+                if attempt > 0:
+                    host.retries += 1
+                start = timer()
+                try:
+                    res.status_code, res.n_bytes, res.checksum, headers_latency = (
+                        await _download_to_file(
+                            client,
+                            url,
+                            pth,
+                            stream,
+                            chunk_size,
+                            max_body_size,
+                            checksum,
+                            retry_policy,
+                        )
+                    )
+                except RetryableStatusError as e:
+                    host.on_failure(e.retry_after)
+                    raise
+                except httpx.RequestError:
+                    host.on_failure()
+                    raise
+                res.latency = timer() - start
+                # the adaptive limits follow the server's response time, not the transfer time of
+                # the body
+                host.on_success(headers_latency)
+            res.downloaded = True
+        except BodyTooLargeError as e:
+            logger.info(f"{log_name}, {pth.name}: {e}")
+            return res
+        except RetryableStatusError as e:
+            res.status_code = e.status_code
+            logger.info(f"{log_name}, {pth.name}: {e}")
+            if attempt + 1 < retry_policy.max_attempts:
+                await asyncio.sleep(retry_policy.delay(attempt, e.retry_after))
+            continue
         except httpx.RequestError:
-            logger.info(f"{accommodation_code}, {file_name}: Request Error")
-            await asyncio.sleep(0.3)
+            logger.info(f"{log_name}, {pth.name}: Request Error")
+            if attempt + 1 < retry_policy.max_attempts:
+                await asyncio.sleep(retry_policy.delay(attempt))
             continue
         except TypeError:
-            logger.info(f"Found invalid url type: {row[url_column_name]}")
-            return row.to_dict()
+            logger.info(f"Found invalid url type: {url}")
+            return res
 
         # verify correct download
-        try:
-            Image.open(_pth).verify()
-        except UnidentifiedImageError:
-            row["downloaded"] = False
-            _pth.unlink()
-            logger.info(f"Bad downloaded imgage found and deleted.")
-    return row.to_dict()
+        if verify:
+            ok = await asyncio.get_running_loop().run_in_executor(None, verify_image, pth)
+            res.downloaded = res.correct_tag = ok
+            if not ok:
+                logger.info(f"Bad downloaded image found and deleted.")
+    return res
@@ -1,22 +1,79 @@
-from typing import Optional, Any
+from typing import Optional, Any, BinaryIO, Callable, Dict, List, Tuple
 from pathlib import Path
 import os
+import bisect
 import datetime
+import functools
+import json
+import mmap
 import platform
 import pickle
+import struct
+import time
 
 __all__ = [
     "get_file_creation_time",
     "get_file_age_in_days",
     "get_last_modified_time",
     "match_search_str_in_dir",
+    "get_dir_index",
     "save_structure",
     "load_structure",
 ]
 
 
-def match_search_str_in_dir(search_str: str, dir: Path) -> Path:
-    matching_files = [f for f in os.listdir(dir) if (dir / f).is_file() and search_str in f]
+# Directory mtimes have a coarse resolution on some file systems (up to 2s on FAT). An index built
+# within that window after the last modification might miss entries added in the same tick, so it is
+# not trusted.
+_RACY_WINDOW_NS = 2_000_000_000
+
+
+class DirIndex:
+    """
+    Snapshot of the file names in a directory, built with a single os.scandir pass (DirEntry.is_file
+    uses the type information returned by the directory listing, so no stat call per entry). Lookup
+    results are memoized.
+    """
+
+    def __init__(self, dir: Path):
+        self.mtime_ns = os.stat(dir).st_mtime_ns
+        self.trusted = time.time_ns() - self.mtime_ns > _RACY_WINDOW_NS
+        with os.scandir(dir) as it:
+            self.files = sorted(e.name for e in it if e.is_file())
+        self._matches: Dict[Tuple[str, bool], List[str]] = {}
+
+    def match(self, search_str: str, prefix: bool = False) -> List[str]:
+        """File names containing 'search_str' (or starting with it, if 'prefix' is set)."""
+        key = (search_str, prefix)
+        if key not in self._matches:
+            if prefix:
+                start = bisect.bisect_left(self.files, search_str)
+                end = start
+                while end < len(self.files) and self.files[end].startswith(search_str):
+                    end += 1
+                self._matches[key] = self.files[start:end]
+            else:
+                self._matches[key] = [f for f in self.files if search_str in f]
+        return self._matches[key]
+
+
+_DIR_INDEXES: Dict[Path, DirIndex] = {}
+
+
+def get_dir_index(dir: Path) -> DirIndex:
+    """
+    Returns the cached index of 'dir'. The index is rebuilt when the modification time of the
+    directory changes (i.e. entries were added, removed or renamed), which costs one stat call per
+    lookup.
+    """
+    index = _DIR_INDEXES.get(dir)
+    if index is None or not index.trusted or index.mtime_ns != os.stat(dir).st_mtime_ns:
+        index = _DIR_INDEXES[dir] = DirIndex(dir)
+    return index
+
+
+def match_search_str_in_dir(search_str: str, dir: Path, prefix: bool = False) -> Path:
+    matching_files = get_dir_index(dir).match(search_str, prefix)
     if len(matching_files) > 1:
         raise ValueError(f"More than one match found for search string {search_str}.")
     if not matching_files:
@@ -25,23 +82,171 @@ def match_search_str_in_dir(search_str: str, dir: Path) -> Path:
     return matching_files[0]
 
 
-def save_structure(obj: Any, name: str, path: Path, overwrite: bool = True) -> None:
+_EXTENSIONS = {
+    ("pickle", None): ".pickle",
+    ("pickle", "zstd"): ".pickle.zst",
+    ("pickle", "lz4"): ".pickle.lz4",
+    ("pickle5", None): ".pkl5",
+    ("pickle5", "zstd"): ".pkl5",
+    ("pickle5", "lz4"): ".pkl5",
+}
+
+_PKL5_MAGIC = b"HPKL5\x00\x00\x00"
+_PKL5_ALIGNMENT = 64
+
+
+def _get_codec(compression: Optional[str]) -> Tuple[Callable, Callable]:
+    """
+    Returns (compress, decompress) functions for 'compression'. decompress returns a writable
+    bytearray, so arrays unpickled from it are writable without another copy. zstd and lz4 are
+    optional dependencies.
+    """
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("compression='zstd' requires the 'zstandard' package.")
+
+        def _decompress(payload) -> bytearray:
+            out = bytearray(zstandard.frame_content_size(payload))
+            with zstandard.ZstdDecompressor().stream_reader(payload) as reader:
+                view = memoryview(out)
+                while view and (n := reader.readinto(view)):
+                    view = view[n:]
+            return out
+
+        return zstandard.ZstdCompressor().compress, _decompress
+    if compression == "lz4":
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ImportError("compression='lz4' requires the 'lz4' package.")
+        return lz4.frame.compress, functools.partial(lz4.frame.decompress, return_bytearray=True)
+    if compression is None:
+        return bytes, bytearray
+    raise ValueError(f"Unknown compression {compression}, use None, 'zstd' or 'lz4'.")
+
+
+def _open_compressed(file_path: Path, mode: str, compression: Optional[str]) -> BinaryIO:
+    _get_codec(compression)  # raises for unknown or missing codecs
+    if compression == "lz4":
+        import lz4.frame
+
+        return lz4.frame.open(file_path, mode)
+
+    f = open(file_path, mode)
+    if compression == "zstd":
+        import zstandard
+
+        if "w" in mode:
+            return zstandard.ZstdCompressor().stream_writer(f)
+        return zstandard.ZstdDecompressor().stream_reader(f)
+    return f
+
+
+def _dump_pickle5(obj: Any, f: BinaryIO, compression: Optional[str]) -> None:
+    """
+    Pickles 'obj' with protocol 5. Large contiguous buffers (e.g. NumPy arrays, numeric DataFrame
+    blocks) are written out-of-band, each aligned to 64 bytes, so they can later be memory-mapped.
+    Layout:
+    magic | buffers | pickle | JSON footer | footer length (uint64).
+    """
+    compress, _ = _get_codec(compression)
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+
+    f.write(_PKL5_MAGIC)
+    offset = len(_PKL5_MAGIC)
+    entries = []
+    for buf in buffers:
+        raw = buf.raw()
+        payload = raw if compression is None else compress(raw)
+        padding = -offset % _PKL5_ALIGNMENT
+        f.write(b"\x00" * padding)
+        offset += padding
+        f.write(payload)
+        entries.append((offset, len(payload)))
+        offset += len(payload)
+
+    f.write(data)
+    footer = json.dumps(
+        {"compression": compression, "buffers": entries, "pickle": (offset, len(data))}
+    ).encode()
+    f.write(footer)
+    f.write(struct.pack("<Q", len(footer)))
+
+
+def _load_pickle5(file_path: Path, use_mmap: bool = True) -> Any:
+    """
+    Loads a file written by '_dump_pickle5'. The file is memory-mapped copy-on-write. If
+    uncompressed and 'use_mmap' is set, out-of-band buffers become zero-copy views into the mapping
+    (pages are only read from disk when accessed, and only copied when written to). Otherwise they
+    are decompressed/copied into memory.
+    """
+    with open(file_path, "rb") as f:
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+
+    if data[: len(_PKL5_MAGIC)] != _PKL5_MAGIC:
+        raise ValueError(f"{file_path} is not a pickle5 structure file.")
+    (footer_len,) = struct.unpack("<Q", data[-8:])
+    footer = json.loads(bytes(data[-8 - footer_len : -8]))
+
+    _, decompress = _get_codec(footer["compression"])
+    buffers = [data[o : o + n] for o, n in footer["buffers"]]
+    if footer["compression"] is not None or not use_mmap:
+        buffers = [decompress(b) for b in buffers]
+    o, n = footer["pickle"]
+    return pickle.loads(data[o : o + n], buffers=buffers)
+
+
+def save_structure(
+    obj: Any,
+    name: str,
+    path: Path,
+    overwrite: bool = True,
+    format: str = "pickle",
+    compression: Optional[str] = None,
+) -> None:
+    """
+    Saves 'obj' as 'name' in 'path'. Formats:
+    'pickle': plain pickle (default), optionally compressed as a whole with 'zstd' or 'lz4'.
+    'pickle5': pickle protocol 5 with out-of-band buffers. Without compression, NumPy arrays and
+    numeric DataFrame columns are loaded as memory-mapped, zero-copy views by 'load_structure'. With
+    compression, every buffer is compressed on its own.
+    """
+    if (format, compression) not in _EXTENSIONS:
+        raise ValueError(f"Unknown format/compression combination: {format}, {compression}.")
+
     if not path.is_dir():
         path.mkdir(parents=True, exist_ok=True)
 
-    file_path = path / f"{name}.pickle"
+    file_path = path / f"{name}{_EXTENSIONS[(format, compression)]}"
 
     if file_path.is_file() and not overwrite:
         print(f"Not saving {file_path}!")
         return
-    with open(file_path, "wb") as f:
-        pickle.dump(obj, f)
+
+    if format == "pickle5":
+        with open(file_path, "wb") as f:
+            _dump_pickle5(obj, f, compression)
+    else:
+        with _open_compressed(file_path, "wb", compression) as f:
+            pickle.dump(obj, f)
 
     print(f"{file_path} saved.")
 
 
-def load_structure(name: str, path: Path) -> None:
-    with open(path / match_search_str_in_dir(name, path), "rb") as f:
+def load_structure(name: str, path: Path, memory_map: bool = True) -> Any:
+    """
+    Loads a structure saved with 'save_structure', the format is determined from the file extension.
+    'memory_map' only applies to uncompressed 'pickle5' files.
+    """
+    file_path = path / match_search_str_in_dir(name, path)
+    if file_path.name.endswith(".pkl5"):
+        return _load_pickle5(file_path, use_mmap=memory_map)
+
+    compression = {".zst": "zstd", ".lz4": "lz4"}.get(file_path.suffix)
+    with _open_compressed(file_path, "rb", compression) as f:
         return pickle.load(f)
 
 
@@ -0,0 +1,138 @@
+from typing import Callable, Dict, Optional, Tuple
+import atexit
+import os
+import threading
+
+from loguru import logger
+
+__all__ = ["configure_logging"]
+
+# messages of this level (WARNING) and above are never suppressed in 'aggregate' mode
+_ALWAYS_LOGGED = 30
+
+_handler_id: Optional[int] = None
+_aggregator: Optional["_CallSiteRateLimiter"] = None
+
+
+def isnotebook():
+    try:
+        shell = get_ipython().__class__.__name__
+        return shell == "ZMQInteractiveShell"
+    except NameError:
+        return False  # Probably standard Python interpreter
+
+
+def _tqdm_write(msg: str) -> None:
+    # tqdm is only imported when the first message is written
+    if isnotebook():
+        from tqdm.notebook import tqdm
+    else:
+        from tqdm import tqdm
+    tqdm.write(msg, end="")
+
+
+class _CallSiteRateLimiter:
+    """
+    loguru filter that lets through at most 'per_site' messages per call site (module, function,
+    line) every 'interval' seconds. WARNING and above are always let through. Suppressed messages
+    are only counted, so they are never formatted or written, and a background thread logs one
+    summary message per call site at the end of every interval.
+    """
+
+    def __init__(self, interval: float, per_site: int):
+        self.interval = interval
+        self.per_site = per_site
+        self._window: Dict[Tuple, int] = {}
+        self._suppressed: Dict[Tuple, Tuple[int, str]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log_aggregator", daemon=True)
+        self._thread.start()
+
+    def __call__(self, record) -> bool:
+        if record["level"].no >= _ALWAYS_LOGGED or record["extra"].get("log_summary"):
+            return True
+        key = (record["name"], record["function"], record["line"])
+        with self._lock:
+            n = self._window[key] = self._window.get(key, 0) + 1
+            if n <= self.per_site:
+                return True
+            count, _, _ = self._suppressed.get(key, (0, "", ""))
+            self._suppressed[key] = (count + 1, record["level"].name, record["message"])
+        return False
+
+    def flush(self) -> None:
+        with self._lock:
+            suppressed, self._suppressed = self._suppressed, {}
+            self._window = {}
+        # logged like any other message (level, format, all sinks), the filter lets it through
+        summary_logger = logger.bind(log_summary=True)
+        for (name, function, line), (count, level, last) in suppressed.items():
+            summary_logger.log(
+                level,
+                f"{name}:{function}:{line} - {count:,} more messages in the last "
+                f"{self.interval:g}s, last: {last}",
+            )
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+
+def configure_logging(
+    mode: Optional[str] = None,
+    level: Optional[str] = None,
+    interval: Optional[float] = None,
+    per_site: Optional[int] = None,
+    write: Optional[Callable[[str], None]] = None,
+) -> None:
+    """
+    (Re)configures the package-level loguru sink. By default it writes through tqdm, so progress
+    bars are not broken; pass 'write' to use a different function.
+    Called on import with the settings from the environment variables HELPERS_LOG_MODE,
+    HELPERS_LOG_LEVEL, HELPERS_LOG_INTERVAL and HELPERS_LOG_PER_SITE; arguments take precedence over
+    them.
+    mode='aggregate' (default): at most 'per_site' (default 10) messages per call site are written
+    every 'interval' (default 5) seconds, the rest is summarized, e.g. "1,243 more messages in the
+    last 5s".
+    WARNING, ERROR and CRITICAL messages are never suppressed.
+    mode='immediate': every message is written.
+    In both modes, messages are written through a queue in a background thread.
+    """
+    global _handler_id, _aggregator
+
+    write = write or _tqdm_write
+    mode = mode or os.environ.get("HELPERS_LOG_MODE", "aggregate")
+    level = level or os.environ.get("HELPERS_LOG_LEVEL", "INFO")
+    interval = interval or float(os.environ.get("HELPERS_LOG_INTERVAL", 5))
+    per_site = per_site or int(os.environ.get("HELPERS_LOG_PER_SITE", 10))
+    if mode not in ("aggregate", "immediate"):
+        raise ValueError(f"Unknown logging mode {mode}, use 'aggregate' or 'immediate'.")
+
+    if _handler_id is None:
+        logger.remove()
+    else:
+        logger.remove(_handler_id)
+    if _aggregator is not None:
+        _aggregator.stop()
+        _aggregator = None
+
+    if mode == "immediate":
+        _handler_id = logger.add(write, colorize=True, enqueue=True, level=level, backtrace=True)
+        return
+
+    _aggregator = _CallSiteRateLimiter(interval, per_site)
+    _handler_id = logger.add(
+        write, colorize=True, enqueue=True, level=level, backtrace=True, filter=_aggregator
+    )
+
+
+@atexit.register
+def _flush_on_exit() -> None:
+    if _aggregator is not None:
+        _aggregator.stop()
@@ -1,46 +1,212 @@
-from typing import Dict, List, Union
-from sklearn.metrics import confusion_matrix
+from typing import Dict, List, Optional, Union
+import numpy as np
 import pandas as pd
 
 from matplotlib import pyplot as plt
 import seaborn as sn
 import torch
-import torchmetrics
 
 
 def calculate_f1_score(
-    preds: Union[List, torch.Tensor], target: Union[List, torch.Tensor], average: str = "micro"
-):
-    if type(preds) == list:
-        preds = torch.as_tensor(preds)
-    if type(target) == list:
-        target = torch.as_tensor(target)
+    preds: Union[List, np.ndarray, torch.Tensor],
+    target: Union[List, np.ndarray, torch.Tensor],
+    average: Optional[str] = "micro",
+) -> Union[float, np.ndarray]:
+    """
+    Multiclass F1 score with average 'micro', 'macro', 'weighted' or None (score of every class),
+    computed with a ConfusionMatrixAccumulator over max(target, preds) + 1 classes. Same results as
+    torchmetrics' f1_score(task="multiclass").
+    """
+    preds, target = _to_numpy(preds), _to_numpy(target)
+    number_of_classes = int(max(target.max(initial=0), preds.max(initial=0))) + 1
+    return ConfusionMatrixAccumulator(number_of_classes).update(target, preds).f1_score(average)
+
+
+def _to_numpy(values: Union[List, np.ndarray, torch.Tensor]) -> np.ndarray:
+    if isinstance(values, torch.Tensor):
+        values = values.detach().cpu().numpy()
+    return np.asarray(values).ravel()
+
+
+def _flat_cm_index(y_true, y_pred, num_classes: int) -> np.ndarray:
+    """Validated true * num_classes + pred, the flat confusion matrix index of every prediction."""
+    y_true, y_pred = _to_numpy(y_true), _to_numpy(y_pred)
+    if y_true.shape != y_pred.shape:
+        raise ValueError(
+            f"y_true and y_pred have different lengths: {len(y_true)} != {len(y_pred)}."
+        )
+    for values in (y_true, y_pred):
+        if values.size and (values.min() < 0 or values.max() >= num_classes):
+            raise ValueError(
+                f"Class indices must be in [0, {num_classes}), "
+                f"got [{values.min()}, {values.max()}]."
+            )
+    return y_true.astype(np.int64) * num_classes + y_pred.astype(np.int64)
+
+
+class ConfusionMatrixAccumulator:
+    """
+    Confusion matrix (rows: true class, columns: predicted class) that is updated batch by batch, so
+    predictions never need to be held in memory at once. Each update is one np.bincount over
+    true * num_classes + pred. Accumulators are picklable and can be merged, e.g. the partial
+    results of worker processes: total = sum(partials, ConfusionMatrixAccumulator(num_classes)).
+    Precision, recall and F1 can be derived at any time; classes that neither occur nor are
+    predicted are ignored in macro averages, and divisions by zero count as 0, like in sklearn.
+    """
+
+    def __init__(self, num_classes: int):
+        self.num_classes = num_classes
+        self.matrix = np.zeros((num_classes, num_classes), dtype=np.int64)
+
+    def update(
+        self,
+        y_true: Union[List, np.ndarray, torch.Tensor],
+        y_pred: Union[List, np.ndarray, torch.Tensor],
+    ) -> "ConfusionMatrixAccumulator":
+        k = self.num_classes
+        flat = _flat_cm_index(y_true, y_pred, k)
+        self.matrix += np.bincount(flat, minlength=k * k).reshape(k, k)
+        return self
+
+    def merge(self, other: "ConfusionMatrixAccumulator") -> "ConfusionMatrixAccumulator":
+        if other.num_classes != self.num_classes:
+            raise ValueError(
+                f"Can't merge {other.num_classes} classes into {self.num_classes} classes."
+            )
+        self.matrix += other.matrix
+        return self
 
-    number_of_classes = max(max(target).item(), max(preds).item()) + 1
-    score = torchmetrics.functional.f1_score(
-        preds=preds, target=target, average=average, num_classes=number_of_classes
-    ).item()
-    return score
+    def __add__(self, other: "ConfusionMatrixAccumulator") -> "ConfusionMatrixAccumulator":
+        return ConfusionMatrixAccumulator(self.num_classes).merge(self).merge(other)
+
+    def reset(self) -> None:
+        self.matrix[:] = 0
+
+    @property
+    def total(self) -> int:
+        return int(self.matrix.sum())
+
+    def _average(self, per_class: np.ndarray, average: Optional[str]) -> Union[float, np.ndarray]:
+        support = self.matrix.sum(axis=1)
+        present = (support + self.matrix.sum(axis=0)) > 0
+        if average is None:
+            return per_class
+        if average == "macro":
+            return float(per_class[present].mean()) if present.any() else 0.0
+        if average == "weighted":
+            return float((per_class * support).sum() / support.sum()) if support.sum() else 0.0
+        raise ValueError(f"Unknown average {average}, use 'micro', 'macro', 'weighted' or None.")
+
+    @staticmethod
+    def _divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return np.divide(a, b, out=np.zeros(len(a)), where=b > 0)
+
+    def precision(self, average: Optional[str] = "micro") -> Union[float, np.ndarray]:
+        if average == "micro":
+            return self.accuracy()
+        tp = np.diag(self.matrix)
+        return self._average(self._divide(tp, self.matrix.sum(axis=0)), average)
+
+    def recall(self, average: Optional[str] = "micro") -> Union[float, np.ndarray]:
+        if average == "micro":
+            return self.accuracy()
+        tp = np.diag(self.matrix)
+        return self._average(self._divide(tp, self.matrix.sum(axis=1)), average)
+
+    def f1_score(self, average: Optional[str] = "micro") -> Union[float, np.ndarray]:
+        """Same averages as calculate_f1_score; average=None returns the score of every class."""
+        if average == "micro":
+            # every false positive is another class' false negative, so micro P = R = F1 = accuracy
+            return self.accuracy()
+        tp = np.diag(self.matrix)
+        f1 = self._divide(2 * tp, self.matrix.sum(axis=0) + self.matrix.sum(axis=1))
+        return self._average(f1, average)
+
+    def accuracy(self) -> float:
+        return float(np.trace(self.matrix) / self.total) if self.total else 0.0
 
 
 def get_cm_from_predictions(
-    y_true: List, y_pred: List, encoding: Dict, normalize: str = "true"
+    y_true: Union[List, np.ndarray, torch.Tensor],
+    y_pred: Union[List, np.ndarray, torch.Tensor],
+    encoding: Dict,
+    normalize: Optional[str] = "true",
+    all_classes: bool = False,
+    sparse: bool = False,
 ) -> pd.DataFrame:
     """
-    Set normalize to None to get absolute numbers.
+    Confusion matrix with the class names of 'encoding' (class name -> encoded label) as index (true
+    class) and columns (predicted class), ordered by encoded label like sklearn.
+    Set normalize to None to get absolute numbers, or to 'true', 'pred' or 'all' to normalize over
+    the true classes (rows), predicted classes (columns) or all predictions.
+    Only classes that occur in y_true or y_pred are included, unless all_classes=True.
+    The matrix is counted with a single np.bincount. For thousands of classes use sparse=True: only
+    non-zero cells are counted and stored, and a sparse DataFrame is returned.
     """
     reverse_encoding = {v: k for k, v in encoding.items()}
+    num_classes = max(reverse_encoding) + 1
+
+    if not sparse:
+        matrix = ConfusionMatrixAccumulator(num_classes).update(y_true, y_pred).matrix.astype(float)
+        row_sums, col_sums = matrix.sum(axis=1), matrix.sum(axis=0)
+        if normalize is not None:
+            rows, cols = np.ogrid[:num_classes, :num_classes]
+            denominator = _cm_denominator(row_sums, col_sums, rows, cols, normalize)
+            matrix = np.divide(
+                matrix, denominator, out=np.zeros_like(matrix), where=denominator > 0
+            )
+        labels = _cm_labels(row_sums + col_sums, reverse_encoding, all_classes)
+        return pd.DataFrame(
+            matrix[np.ix_(labels, labels)].round(2),
+            index=[reverse_encoding[i] for i in labels],
+            columns=[reverse_encoding[i] for i in labels],
+        )
+
+    from scipy.sparse import csr_matrix
+
+    codes, counts = np.unique(_flat_cm_index(y_true, y_pred, num_classes), return_counts=True)
+    rows, cols = np.divmod(codes, num_classes)
+    row_sums = np.bincount(rows, weights=counts, minlength=num_classes)
+    col_sums = np.bincount(cols, weights=counts, minlength=num_classes)
+    values = counts.astype(float)
+    if normalize is not None:
+        values /= _cm_denominator(row_sums, col_sums, rows, cols, normalize)
+    matrix = csr_matrix((values.round(2), (rows, cols)), shape=(num_classes, num_classes))
+    labels = _cm_labels(row_sums + col_sums, reverse_encoding, all_classes)
+    names = [reverse_encoding[i] for i in labels]
+    columns = pd.DataFrame.sparse.from_spmatrix(matrix[labels][:, labels])
+    # newer pandas versions fill the empty cells with NaN, they have to read as 0 like in the dense
+    # matrix
+    return pd.DataFrame(
+        {
+            name: pd.arrays.SparseArray(col.sp_values, sparse_index=col.sp_index, fill_value=0.0)
+            for name, col in zip(names, (columns[c].array for c in columns.columns))
+        },
+        index=names,
+    )
+
 
-    classes = [reverse_encoding[i] for i in set(y_pred).union(set(y_true))]
+def _cm_denominator(
+    row_sums: np.ndarray, col_sums: np.ndarray, rows: np.ndarray, cols: np.ndarray, normalize: str
+) -> np.ndarray:
+    """Denominators of the cells (rows, cols) for 'normalize'."""
+    if normalize == "true":
+        return row_sums[rows]
+    if normalize == "pred":
+        return col_sums[cols]
+    if normalize == "all":
+        return np.full(np.broadcast(rows, cols).shape, row_sums.sum())
+    raise ValueError(f"Unknown normalize {normalize}, use 'true', 'pred', 'all' or None.")
 
-    cf_matrix = confusion_matrix(y_true, y_pred, normalize=normalize)
 
-    df = pd.DataFrame(
-        cf_matrix,
-        index=classes,
-        columns=classes,
-    ).round(2)
-    return df
+def _cm_labels(occurrences: np.ndarray, reverse_encoding: Dict, all_classes: bool) -> np.ndarray:
+    if all_classes:
+        return np.array(sorted(reverse_encoding))
+    labels = np.flatnonzero(occurrences)
+    unknown = [i for i in labels if i not in reverse_encoding]
+    if unknown:
+        raise ValueError(f"Labels {unknown} are not in 'encoding'.")
+    return labels
 
 
 def plot_and_save_dual_cm(df_A: pd.DataFrame, df_B: pd.DataFrame, save_to_file: str):
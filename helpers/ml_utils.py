@@ -1,11 +1,25 @@
 import copy
-from dataclasses import dataclass
-from typing import Dict, Type
-
+import dataclasses
+import hashlib
+import itertools
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
 from pydantic import BaseModel, validator
 from torch import optim
 from torch.optim import lr_scheduler
 from torchvision.transforms import transforms as T
+from torchvision.transforms.functional import pil_to_tensor
 
 
 def get_default_config_options():
@@ -27,7 +41,50 @@ def get_default_config_options():
     return {"transforms": transforms, "optim": optimizers, "lr_scheduler": lr_schedulers}
 
 
-CURRENT_FIELD_OPTIONS = get_default_config_options()
+_field_options: Optional[Dict[str, Dict[str, Any]]] = None
+_registered_options: Dict[str, Dict[str, Any]] = {}
+_options_lock = threading.Lock()
+
+
+def get_field_options() -> Dict[str, Dict[str, Any]]:
+    """
+    Options for the fields of SerializableConfigDict: the defaults of get_default_config_options
+    plus everything added with register_option. Built on first use instead of at import.
+    """
+    global _field_options
+    with _options_lock:
+        if _field_options is None:
+            options = get_default_config_options()
+            for field_name, entries in _registered_options.items():
+                options.setdefault(field_name, {}).update(entries)
+            _field_options = options
+        return _field_options
+
+
+def register_option(field_name: str, name: str, obj: Any = None):
+    """
+    Makes 'obj' (e.g. a custom transform class) available as option 'name' of 'field_name'
+    ('transforms', 'optim' or 'lr_scheduler'). Can be used as a decorator:
+    @register_option("transforms", "swapaxes").
+    Names are case-insensitive, registering an existing name replaces the option.
+    """
+    if obj is None:
+        return lambda o: register_option(field_name, name, o)
+
+    with _options_lock:
+        _registered_options.setdefault(field_name, {})[name.lower()] = obj
+        if _field_options is not None:
+            _field_options.setdefault(field_name, {})[name.lower()] = obj
+    # Cached configs might have been built with a replaced option
+    InternalConfig.cache_clear()
+    return obj
+
+
+def __getattr__(name):
+    # CURRENT_FIELD_OPTIONS used to be built at import, it's still available (lazily)
+    if name == "CURRENT_FIELD_OPTIONS":
+        return get_field_options()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class SerializableConfigDict(BaseModel):
@@ -53,15 +110,15 @@ class SerializableConfigDict(BaseModel):
 
     @staticmethod
     def get_options():
-        return CURRENT_FIELD_OPTIONS
+        return get_field_options()
 
-    # validators for fields defined in CURRENT_FIELD_OPTIONS
+    # validators for fields defined in get_field_options()
     @validator("optim")
     def _check_valid_optim(cls, v):
         assert len(v) == 1, "Please provide only a single optimizer."
         optim_name = next(iter(v))
         assert (
-            optim_name.lower() in CURRENT_FIELD_OPTIONS["optim"]
+            optim_name.lower() in get_field_options()["optim"]
         ), f"{optim_name} not in the list of known optimizers, check SerializableConfigDict.get_options()."
         return v
 
@@ -69,7 +126,7 @@ class SerializableConfigDict(BaseModel):
     def _check_valid_scheduler(cls, v):
         for name in v:
             assert (
-                name.lower() in CURRENT_FIELD_OPTIONS["lr_scheduler"]
+                name.lower() in get_field_options()["lr_scheduler"]
             ), f"{name} not in the list of known LR schedulers, check SerializableConfigDict.get_options()."
         return v
 
@@ -77,7 +134,7 @@ class SerializableConfigDict(BaseModel):
     def _check_valid_transforms(cls, v):
         for name in v:
             assert (
-                name.lower() in CURRENT_FIELD_OPTIONS["transforms"]
+                name.lower() in get_field_options()["transforms"]
             ), f"{name} not in the list of known transforms, check SerializableConfigDict.get_options()."
         return v
 
@@ -98,6 +155,11 @@ class SerializableConfigDict(BaseModel):
         )
 
 
+_CONFIG_CACHE_SIZE = 1024
+_config_cache: "OrderedDict[str, InternalConfig]" = OrderedDict()
+_config_cache_lock = threading.Lock()
+
+
 @dataclass
 class InternalConfig:
     """
@@ -122,10 +184,66 @@ class InternalConfig:
     # in which those values are not present.
     new_param_1: int = 2000
     new_param_2: bool = True
-    new_param_3: Dict = {}
+    new_param_3: Dict = field(default_factory=dict)
+    # Only set by from_dict(..., batch_transforms=True), see compile_batch_transforms
+    batch_transforms: Optional["BatchTransforms"] = None
 
     @classmethod
-    def from_dict(cls, input_dict: Dict):
+    def from_dict(cls, input_dict: Dict, batch_transforms: bool = False, cache: bool = True):
+        """
+        Constructs the config from the dict version of a SerializableConfigDict.
+        With batch_transforms=True, the transforms are additionally compiled into
+        'batch_transforms', which processes whole (N, C, H, W) batches, e.g. after the DataLoader
+        instead of in its workers.
+        Results are cached by a canonical hash of 'input_dict' (key order and tuple vs. list don't
+        matter, the order of the transforms does), so identical configs share their transform
+        instances. Every call returns a new InternalConfig with copies of the dict fields, so
+        changing attributes doesn't leak into other configs.
+        """
+        if not cache:
+            return cls._from_dict(input_dict, batch_transforms)
+
+        # json sorts all keys and treats tuples as lists, only the transforms keep their order
+        transforms = [
+            [name.lower(), params] for name, params in input_dict.get("transforms", {}).items()
+        ]
+        canonical = json.dumps(
+            [
+                cls.__module__,
+                cls.__qualname__,
+                batch_transforms,
+                {**input_dict, "transforms": transforms},
+            ],
+            sort_keys=True,
+            default=repr,
+        )
+        key = hashlib.blake2b(canonical.encode()).hexdigest()
+        with _config_cache_lock:
+            cached = _config_cache.get(key)
+            if cached is not None:
+                _config_cache.move_to_end(key)
+        if cached is None:
+            cached = cls._from_dict(input_dict, batch_transforms)
+            with _config_cache_lock:
+                _config_cache[key] = cached
+                while len(_config_cache) > _CONFIG_CACHE_SIZE:
+                    _config_cache.popitem(last=False)
+        return dataclasses.replace(
+            cached,
+            **{
+                f.name: copy.copy(getattr(cached, f.name))
+                for f in dataclasses.fields(cached)
+                if isinstance(getattr(cached, f.name), dict)
+            },
+        )
+
+    @staticmethod
+    def cache_clear() -> None:
+        with _config_cache_lock:
+            _config_cache.clear()
+
+    @classmethod
+    def _from_dict(cls, input_dict: Dict, batch_transforms: bool):
         """Implement logic for constructing fields from dictionary here."""
 
         local_dict = copy.deepcopy(input_dict)
@@ -136,7 +254,7 @@ class InternalConfig:
         scheduler_arg = local_dict.pop("lr_scheduler")
 
         for t in transforms:
-            if t.lower() not in CURRENT_FIELD_OPTIONS["transforms"]:
+            if t.lower() not in get_field_options()["transforms"]:
                 raise ValueError(
                     f"{t} not in the list of known transforms, check SerializableConfigDict.get_options()."
                 )
@@ -157,6 +275,9 @@ class InternalConfig:
 
         return cls(
             transforms=transforms,
+            batch_transforms=(
+                compile_batch_transforms(input_dict["transforms"]) if batch_transforms else None
+            ),
             optim=optim_type,
             optim_params=optim_params,
             lr_scheduler=scheduler_type,
@@ -180,11 +301,314 @@ def remove_random_transforms(input_transforms: T.Compose) -> T.Compose:
         if isinstance(t, T.RandomCrop):
             target_size = t.size
             output_transforms.append(T.CenterCrop(target_size))
-        elif "random" in t._get_name().lower():
+        elif "random" in type(t).__name__.lower():
             continue
-        elif t._get_name().lower() in ["colorjitter"]:
+        elif type(t).__name__.lower() in ["colorjitter"]:
             continue
         else:
             output_transforms.append(t)
 
     return T.Compose(output_transforms)
+
+
+_INTERPOLATION_MODES = {"nearest": "nearest", "bilinear": "bilinear", "bicubic": "bicubic"}
+
+
+def _pair(size: Union[int, List[int], Tuple[int, ...]]) -> Tuple[int, int]:
+    if isinstance(size, int):
+        return size, size
+    return (size[0], size[0]) if len(size) == 1 else (size[0], size[1])
+
+
+class BatchTransforms:
+    """
+    Batch version of a transforms config, created by compile_batch_transforms. Called with a stacked
+    (N, C, H, W) tensor (uint8 or float), returns a float32 tensor.
+    Random crop offsets and flips are drawn for the whole batch at once, and all crops and flips are
+    composed into one window (offset, size, flip) per sample. ToTensor / ConvertImageDtype and
+    Normalize are folded into one per-channel scale and shift, which is applied while the windows
+    are copied out of the batch, on the already cropped pixels (they are per-pixel, so the order
+    doesn't matter). On CPU, copying the windows as slices is several times faster than a single
+    gather over the batch.
+    """
+
+    def __init__(self, stages: List[Tuple], to_float: bool, mean: torch.Tensor, std: torch.Tensor):
+        self.stages = stages
+        self.to_float = to_float
+        self.mean = mean
+        self.std = std
+
+    def __repr__(self) -> str:
+        stages = ", ".join(f"{s[0]}{tuple(s[1:])}" for s in self.stages)
+        return (
+            f"BatchTransforms([{stages}], to_float={self.to_float}, mean={self.mean.tolist()}, "
+            f"std={self.std.tolist()})"
+        )
+
+    def __call__(
+        self, x: torch.Tensor, generator: Optional[torch.Generator] = None
+    ) -> torch.Tensor:
+        n = x.shape[0]
+        window = None
+        # resizing turns the batch into float32, the 1/255 of ToTensor depends on the input dtype
+        from_uint8 = x.dtype == torch.uint8
+        converted = False
+
+        for kind, *params in self.stages:
+            if kind == "to_float":
+                # the conversion itself is folded into the final scale, only its position matters
+                converted = True
+                continue
+            if window is None:
+                zeros, no_flip = torch.zeros(n, dtype=torch.long), torch.zeros(n, dtype=torch.bool)
+                window = [zeros, zeros, x.shape[2], x.shape[3], no_flip, no_flip]
+            top, left, height, width, hflip, vflip = window
+            if kind == "crop":
+                (h, w), random = params
+                if h > height or w > width:
+                    raise ValueError(
+                        f"Crop size {(h, w)} is larger than the images {(height, width)}."
+                    )
+                if random:
+                    dy = torch.randint(0, height - h + 1, (n,), generator=generator)
+                    dx = torch.randint(0, width - w + 1, (n,), generator=generator)
+                else:
+                    # same rounding as torchvision's center_crop
+                    dy = torch.full((n,), int(round((height - h) / 2.0)))
+                    dx = torch.full((n,), int(round((width - w) / 2.0)))
+                # offsets are relative to the (possibly flipped) window
+                top = top + torch.where(vflip, height - h - dy, dy)
+                left = left + torch.where(hflip, width - w - dx, dx)
+                window = [top, left, h, w, hflip, vflip]
+            elif kind == "flip":
+                axis, p = params
+                flip = torch.rand(n, generator=generator) < p
+                if axis == "horizontal":
+                    window[4] = hflip ^ flip
+                else:
+                    window[5] = vflip ^ flip
+            elif kind == "resize":
+                size, mode, antialias = params
+                x = self._copy_windows(x, window, torch.ones(x.shape[1], 1, 1))
+                window = None
+                h, w = x.shape[2:]
+                if isinstance(size, int):
+                    # like torchvision: the smaller edge is matched to 'size'
+                    size = (size, int(size * w / h)) if h <= w else (int(size * h / w), size)
+                x = F.interpolate(
+                    x,
+                    size=size,
+                    mode=mode,
+                    antialias=antialias and mode != "nearest",
+                    align_corners=None if mode == "nearest" else False,
+                )
+                if from_uint8 and not converted:
+                    # torchvision's Resize returns uint8 for uint8 input, float input is not rounded
+                    x = x.round_().clamp_(0, 255)
+
+        scale = ((1 / 255 if self.to_float and from_uint8 else 1.0) / self.std).view(-1, 1, 1)
+        shift = (-self.mean / self.std).view(1, -1, 1, 1)
+        if window is None:
+            return torch.mul(x, scale).add_(shift)
+        return self._copy_windows(x, window, scale).add_(shift)
+
+    @staticmethod
+    def _copy_windows(x: torch.Tensor, window: List, scale: torch.Tensor) -> torch.Tensor:
+        """Copies each sample's (possibly flipped) window into a new float32 batch times 'scale'."""
+        top, left, h, w, hflip, vflip = window
+        out = torch.empty((x.shape[0], x.shape[1], h, w), dtype=torch.float32)
+        for i, (t, l, hf, vf) in enumerate(
+            zip(top.tolist(), left.tolist(), hflip.tolist(), vflip.tolist())
+        ):
+            sample = x[i, :, t : t + h, l : l + w]
+            if hf or vf:
+                sample = sample.flip([d for d, f in ((-1, hf), (-2, vf)) if f])
+            torch.mul(sample, scale, out=out[i])
+        return out
+
+
+def compile_batch_transforms(transforms: Dict[str, Dict], train: bool = True) -> BatchTransforms:
+    """
+    Compiles the 'transforms' dict of a SerializableConfigDict into a BatchTransforms pipeline for
+    stacked (N, C, H, W) tensors. Supported: RandomCrop, CenterCrop, RandomHorizontalFlip,
+    RandomVerticalFlip, Resize, ToTensor, ConvertImageDtype and Normalize. Other transforms raise a
+    ValueError, use the per-sample Compose of InternalConfig for them.
+    With train=False, random transforms are replaced like in remove_random_transforms: RandomCrop
+    becomes a center crop, random flips are dropped.
+    """
+    stages = []
+    to_float = False
+    mean, std = torch.zeros(1), torch.ones(1)
+
+    for name, params in transforms.items():
+        key = name.lower()
+        if key == "randomcrop":
+            if params.get("padding") or params.get("pad_if_needed"):
+                raise ValueError("RandomCrop with padding has no batched version.")
+            stages.append(("crop", _pair(params["size"]), train))
+        elif key == "centercrop":
+            stages.append(("crop", _pair(params["size"]), False))
+        elif key in ("randomhorizontalflip", "randomverticalflip"):
+            if train:
+                stages.append(("flip", key[6:-4], params.get("p", 0.5)))
+        elif key == "resize":
+            if params.get("max_size") is not None:
+                raise ValueError("Resize with max_size has no batched version.")
+            interpolation = params.get("interpolation", T.InterpolationMode.BILINEAR)
+            mode = _INTERPOLATION_MODES.get(getattr(interpolation, "value", interpolation))
+            if mode is None:
+                raise ValueError(f"Interpolation {interpolation} has no batched version.")
+            size = params["size"]
+            size = size if isinstance(size, int) else _pair(size)
+            stages.append(("resize", size, mode, params.get("antialias", True)))
+        elif key in ("totensor", "convertimagedtype"):
+            stages.append(("to_float",))
+            to_float = True
+        elif key == "normalize":
+            # Normalizing twice: ((x - m1) / s1 - m2) / s2 = (x - (m1 + m2 * s1)) / (s1 * s2)
+            m, s = torch.tensor(params["mean"], dtype=torch.float32), torch.tensor(
+                params["std"], dtype=torch.float32
+            )
+            mean, std = mean + m * std, std * s
+        else:
+            raise ValueError(f"{name} has no batched version, use the per-sample transforms.")
+
+    return BatchTransforms(stages, to_float, mean, std)
+
+
+def _load_transformed(path: str, transforms: T.Compose) -> np.ndarray:
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+    if not any(isinstance(t, (T.ToTensor, T.PILToTensor)) for t in transforms.transforms):
+        # like the default config, which normalizes float tensors with values in [0, 255]
+        img = pil_to_tensor(img).float()
+    return np.asarray(transforms(img))
+
+
+def _transform_rows(items: List[Tuple[int, str]], transforms: T.Compose, data_path: str) -> None:
+    """Worker of precompute_transforms: writes the transformed images into their file rows."""
+    data = np.load(data_path, mmap_mode="r+")
+    for row, path in items:
+        data[row] = _load_transformed(path, transforms)
+    data.flush()
+
+
+class PreprocessedImages:
+    """
+    Read access to the images precomputed by precompute_transforms. Images are memory-mapped
+    copy-on-write, so tensors are views of the files (writable, without changing them).
+    """
+
+    def __init__(self, directory: Path, index: Dict):
+        self.directory = directory
+        self.files: Dict[str, List[int]] = index["files"]
+        self.segments = [np.load(directory / name, mmap_mode="c") for name in index["segments"]]
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __contains__(self, path) -> bool:
+        return str(path) in self.files
+
+    def __getitem__(self, path) -> torch.Tensor:
+        segment, row = self.files[str(path)][:2]
+        return torch.from_numpy(self.segments[segment][row])
+
+    def batch(self, paths: Iterable) -> torch.Tensor:
+        """
+        Stacked tensor of the images of 'paths'. Zero-copy if they were precomputed in one call and
+        are requested in the same order, e.g. evaluating with the same list of paths again.
+        """
+        locations = [self.files[str(p)][:2] for p in paths]
+        segment, first = locations[0]
+        if locations == [[segment, first + i] for i in range(len(locations))]:
+            return torch.from_numpy(self.segments[segment][first : first + len(locations)])
+        return torch.from_numpy(np.stack([self.segments[s][r] for s, r in locations]))
+
+    def batches(self, paths: Iterable, batch_size: int = 64) -> Iterator[torch.Tensor]:
+        paths = iter(paths)
+        while batch := list(itertools.islice(paths, batch_size)):
+            yield self.batch(batch)
+
+
+def precompute_transforms(
+    image_paths: Iterable,
+    transforms: T.Compose,
+    cache_dir: Path,
+    workers: Optional[int] = None,
+    task_size: int = 64,
+) -> PreprocessedImages:
+    """
+    Applies the deterministic part of 'transforms' (see remove_random_transforms) to all images
+    once, in a pool of 'workers' processes, and stores the results as .npy files in 'cache_dir'.
+    Returns a PreprocessedImages to read (batches of) the results memory-mapped, for repeated
+    offline evaluation.
+    Results are stored per hash of the transform chain (its repr, which includes the parameters of
+    torchvision transforms), so changing the config never reuses stale tensors. Within a chain,
+    images are keyed by path and recomputed if their size or modification time changed. Only missing
+    images are computed, into a new segment file. Images are loaded as RGB PIL images, or as float
+    CHW tensors with values in [0, 255] if the chain doesn't contain ToTensor / PILToTensor. All
+    transformed images need to have the same shape.
+    A cache directory must not be written by multiple processes at once.
+    """
+    transforms = remove_random_transforms(transforms)
+    directory = (
+        Path(cache_dir) / hashlib.blake2b(repr(transforms).encode(), digest_size=16).hexdigest()
+    )
+    directory.mkdir(parents=True, exist_ok=True)
+    index_path = directory / "index.json"
+    if index_path.exists():
+        index = json.loads(index_path.read_text())
+    else:
+        index = {
+            "transforms": repr(transforms),
+            "shape": None,
+            "dtype": None,
+            "segments": [],
+            "files": {},
+        }
+
+    todo = {}
+    for path in map(str, image_paths):
+        stat = os.stat(path)
+        entry = index["files"].get(path)
+        if entry is None or entry[2:] != [stat.st_mtime_ns, stat.st_size]:
+            todo[path] = [stat.st_mtime_ns, stat.st_size]
+    if not todo:
+        return PreprocessedImages(directory, index)
+
+    paths = list(todo)
+    first = _load_transformed(paths[0], transforms)
+    if index["shape"] is None:
+        index["shape"], index["dtype"] = list(first.shape), first.dtype.str
+    elif [list(first.shape), first.dtype.str] != [index["shape"], index["dtype"]]:
+        raise ValueError(
+            f"Transformed images have shape {first.shape}, the cache holds {index['shape']}."
+        )
+
+    segment = len(index["segments"])
+    data_path = directory / f"segment_{segment}.npy"
+    data = np.lib.format.open_memmap(
+        data_path, mode="w+", dtype=first.dtype, shape=(len(paths), *first.shape)
+    )
+    data[0] = first
+    data.flush()
+    del data
+
+    items = list(enumerate(paths))[1:]
+    tasks = [items[i : i + task_size] for i in range(0, len(items), task_size)]
+    # One thread per worker process, the pool provides the parallelism
+    if tasks:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=torch.set_num_threads, initargs=(1,)
+        ) as pool:
+            args = itertools.repeat(transforms), itertools.repeat(str(data_path))
+            list(pool.map(_transform_rows, tasks, *args))
+
+    index["segments"].append(data_path.name)
+    for row, path in enumerate(paths):
+        index["files"][path] = [segment, row, *todo[path]]
+    tmp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(index))
+    os.replace(tmp_path, index_path)
+    return PreprocessedImages(directory, index)
@@ -1,32 +1,541 @@
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple, Union
+from collections import deque
+from pathlib import Path
+import importlib.util
+import os
+
+import numpy as np
 import pandas as pd
+from pandas.io.formats.style import Styler
 
-__all__ = ["detailed_df_info"]
+__all__ = [
+    "detailed_df_info",
+    "optimize_df_memory",
+    "read_chunks",
+    "process_chunks",
+    "write_chunks",
+    "ChunkWriter",
+]
 
 
-def detailed_df_info(df: pd.DataFrame, ex_vals_char_lmt: int = 100) -> pd.DataFrame:
-    limit = ex_vals_char_lmt or 10_000
-    ex_vals = []
-    for c in df:
-        if not (non_nans := df.loc[~df[c].isna(), c]).empty:
-            val = non_nans.sample(1).item()
-            ex_vals.append(
-                val[:limit] + " ..." if isinstance(val, str) and (len(val) > limit) else val
-            )
-        else:
-            ex_vals.append(df[c].sample(1).item())
-    return (
-        pd.concat(
+def detailed_df_info(
+    df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+    ex_vals_char_lmt: int = 100,
+    fast: bool = False,
+    sample_size: int = 100_000,
+    styled: bool = True,
+    random_state: Optional[int] = None,
+) -> Union[Styler, pd.DataFrame]:
+    """
+    Overview of all columns of 'df': dtype, memory usage, an example value and the percentage of
+    missing values.
+    Returned as a Styler for notebooks, or as a plain DataFrame with styled=False.
+
+    fast=True is meant for very wide or long frames: null counts are computed column by column (no
+    boolean copy of the whole frame), example values are taken from one random sample of
+    'sample_size' rows, and the deep memory usage of object columns is extrapolated from that sample
+    instead of measuring every Python object.
+    Adds the column "Distinct (est.)", the number of distinct non-null values estimated from the
+    sample (exact if the sample covers all rows).
+
+    'df' can also be an iterable of chunks, e.g. from read_chunks(), to profile data that does not
+    fit into memory. Chunks are profiled like in fast mode, but null counts and deep memory usage
+    are exact.
+    """
+    if not isinstance(df, pd.DataFrame):
+        info = _chunked_df_info(df, ex_vals_char_lmt, sample_size, random_state)
+    elif not fast:
+        limit = ex_vals_char_lmt or 10_000
+        ex_vals = []
+        for c in df:
+            if not (non_nans := df.loc[~df[c].isna(), c]).empty:
+                ex_vals.append(_truncate(non_nans.sample(1).item(), limit))
+            else:
+                ex_vals.append(df[c].sample(1).item())
+        info = pd.concat(
             [
                 df.dtypes.rename("DType"),
-                (df.memory_usage(deep=True) / (2 ** 20)).rename("Mem usage [MB]"),
+                (df.memory_usage(deep=True) / (2**20)).rename("Mem usage [MB]"),
                 pd.Series(ex_vals, index=df.columns).rename("Example value"),
                 (df.isna().sum() / len(df) * 100).astype(int).rename("% NaNs"),
             ],
             axis=1,
+        ).rename_axis("Column", axis=1)
+    else:
+        info = _fast_df_info(df, ex_vals_char_lmt, sample_size, random_state)
+
+    return _style_df_info(info) if styled else info
+
+
+def _truncate(val: Any, limit: int) -> Any:
+    return val[:limit] + " ..." if isinstance(val, str) and (len(val) > limit) else val
+
+
+def _sample_rows(df: pd.DataFrame, sample_size: int, random_state: Optional[int]) -> pd.DataFrame:
+    if len(df) <= sample_size:
+        return df
+    rng = np.random.default_rng(random_state)
+    # Sorted positions, so the take walks every column front to back
+    return df.iloc[np.sort(rng.choice(len(df), sample_size, replace=False))]
+
+
+def _holds_python_objects(dtype) -> bool:
+    return dtype == object or (isinstance(dtype, pd.StringDtype) and dtype.storage == "python")
+
+
+def _estimate_memory_usage(df: pd.DataFrame, sample: pd.DataFrame) -> pd.Series:
+    """
+    memory_usage(deep=True) in bytes. Only columns holding Python objects need a deep scan, their
+    usage (and that of an object index) is extrapolated from 'sample'.
+    """
+    mem = df.memory_usage(deep=False).astype(float)
+    scale = len(df) / max(len(sample), 1)
+    object_cols = [i for i, dtype in enumerate(df.dtypes) if _holds_python_objects(dtype)]
+    if object_cols:
+        mem.iloc[[i + 1 for i in object_cols]] = (
+            sample.iloc[:, object_cols].memory_usage(deep=True, index=False).to_numpy() * scale
         )
-        .rename_axis("Column", axis=1)
-        .style.background_gradient(axis=0, subset=["% NaNs"], cmap="YlOrRd")
+    if _holds_python_objects(df.index.dtype):
+        mem["Index"] = sample.index.memory_usage(deep=True) * scale
+    return mem
+
+
+def _estimate_distinct(sample_col: pd.Series, n_non_null: int) -> float:
+    """
+    Hybrid estimator (Haas et al. 1995) of the number of distinct values from a sample of the
+    column. If the sampled frequencies look uniform (chi-squared test), the number of distinct
+    values is solved from the expected number of distinct values in a sample of that size, otherwise
+    Shlosser's estimator is used. Both are exact for unique columns (unlike e.g. GEE, which is
+    sqrt(n / sample size) too low there).
+    """
+    try:
+        counts = sample_col.value_counts(dropna=True)
+    except TypeError:  # unhashable values, e.g. lists
+        return np.nan
+    n_sampled = int(counts.sum())
+    if n_sampled == 0:
+        return 0.0 if n_non_null == 0 else np.nan
+    distinct = len(counts)
+    if n_sampled >= n_non_null:
+        return float(distinct)
+
+    q = n_sampled / n_non_null
+    c = counts.to_numpy(dtype=float)
+    expected = n_sampled / distinct
+    chi2 = ((c - expected) ** 2).sum() / expected
+    dof = max(distinct - 1, 1)
+    if chi2 <= dof + 2.33 * np.sqrt(2 * dof):  # normal approximation of the 99% quantile
+        # a sample drawn from D equally frequent values holds D * (1 - (1 - q) ** (n / D)) distinct
+        # values
+        lo, hi = float(distinct), float(n_non_null)
+        for _ in range(64):
+            mid = (lo + hi) / 2
+            if mid * (1 - (1 - q) ** (n_non_null / mid)) < distinct:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    freq_of_freq = counts.value_counts()
+    i, f = freq_of_freq.index.to_numpy(dtype=float), freq_of_freq.to_numpy(dtype=float)
+    once = float(freq_of_freq.get(1, 0))
+    estimate = distinct + once * ((1 - q) ** i * f).sum() / (i * q * (1 - q) ** (i - 1) * f).sum()
+    return float(min(max(estimate, distinct), n_non_null))
+
+
+def _fast_df_info(
+    df: pd.DataFrame, ex_vals_char_lmt: int, sample_size: int, random_state: Optional[int]
+) -> pd.DataFrame:
+    n = len(df)
+    sample = _sample_rows(df, sample_size, random_state)
+    n_nans = pd.Series(
+        [int(df.iloc[:, i].isna().sum()) for i in range(df.shape[1])],
+        index=df.columns,
+        dtype="int64",
+    )
+
+    def _first_valid(i: int) -> Any:
+        col = df.iloc[:, i]
+        return col.iloc[[int(col.notna().to_numpy().argmax())]].item()
+
+    return _sampled_df_info(
+        df.dtypes,
+        _estimate_memory_usage(df, sample),
+        n_nans,
+        n,
+        sample,
+        _first_valid,
+        ex_vals_char_lmt,
+        random_state,
+    )
+
+
+def _chunked_df_info(
+    chunks: Iterable[pd.DataFrame],
+    ex_vals_char_lmt: int,
+    sample_size: int,
+    random_state: Optional[int],
+) -> pd.DataFrame:
+    """
+    detailed_df_info for a chunk iterator. Counts and memory usage are summed over the chunks, and a
+    uniform sample of 'sample_size' rows is kept (the rows with the smallest random keys) for
+    example values and distinct estimates.
+    """
+    rng = np.random.default_rng(random_state)
+    n = 0
+    schema, sample = None, None
+    sample_keys = np.empty(0)
+    n_nans, mem = pd.Series(dtype="int64"), pd.Series(dtype=float)
+    first_values = {}
+    for chunk in chunks:
+        # Empty frames concatenate to the dtype the chunks would have together
+        schema = chunk.iloc[:0] if schema is None else pd.concat([schema, chunk.iloc[:0]])
+        n += len(chunk)
+        chunk_nans = chunk.isna().sum()
+        n_nans = n_nans.add(chunk_nans, fill_value=0)
+        mem = mem.add(chunk.memory_usage(deep=True), fill_value=0)
+        for c in chunk_nans.index[(chunk_nans < len(chunk)).to_numpy()]:
+            if c not in first_values:
+                col = chunk[c]
+                first_values[c] = col.iloc[[int(col.notna().to_numpy().argmax())]].item()
+
+        keys = np.concatenate([sample_keys, rng.random(len(chunk))])
+        keep = np.arange(len(keys))
+        if len(keys) > sample_size:
+            keep = np.sort(np.argpartition(keys, sample_size)[:sample_size])
+        m = len(sample_keys)
+        parts = [] if sample is None else [sample.iloc[keep[keep < m]]]
+        sample = pd.concat([*parts, chunk.iloc[keep[keep >= m] - m]])
+        sample_keys = keys[keep]
+
+    if schema is None:
+        raise ValueError("The chunk iterator is empty.")
+    columns = schema.columns
+    return _sampled_df_info(
+        schema.dtypes,
+        mem.reindex(["Index", *columns]),
+        n_nans.reindex(columns).astype("int64"),
+        n,
+        sample.reindex(columns=columns),
+        lambda i: first_values[columns[i]],
+        ex_vals_char_lmt,
+        random_state,
+    )
+
+
+def _sampled_df_info(
+    dtypes: pd.Series,
+    mem: pd.Series,
+    n_nans: pd.Series,
+    n: int,
+    sample: pd.DataFrame,
+    first_valid: Callable[[int], Any],
+    ex_vals_char_lmt: int,
+    random_state: Optional[int],
+) -> pd.DataFrame:
+    limit = ex_vals_char_lmt or 10_000
+    ex_vals, distinct = [], []
+    for i in range(len(dtypes)):
+        sample_col = sample.iloc[:, i]
+        if not (non_nans := sample_col[sample_col.notna()]).empty:
+            val = non_nans.sample(1, random_state=random_state).item()
+        elif n_nans.iloc[i] < n:
+            # Sparse column without a value in the sample: take the first non-null value
+            val = first_valid(i)
+        else:
+            val = None
+        ex_vals.append(_truncate(val, limit))
+        distinct.append(_estimate_distinct(sample_col, n - n_nans.iloc[i]))
+
+    return pd.concat(
+        [
+            dtypes.rename("DType"),
+            (mem / (2**20)).rename("Mem usage [MB]"),
+            pd.Series(ex_vals, index=dtypes.index, dtype=object).rename("Example value"),
+            (n_nans / max(n, 1) * 100).astype(int).rename("% NaNs"),
+            pd.Series(distinct, index=dtypes.index).rename("Distinct (est.)"),
+        ],
+        axis=1,
+    ).rename_axis("Column", axis=1)
+
+
+def _style_df_info(info: pd.DataFrame) -> Styler:
+    styler = (
+        info.style.background_gradient(axis=0, subset=["% NaNs"], cmap="YlOrRd")
         .format("{:.0f}", subset=["% NaNs"])
-        .format("{:.2f}", subset=["Mem usage [MB]"])
+        .format("{:.2f}", subset=[c for c in info if c.startswith("Mem usage")])
         .format(hyperlinks="html", subset=["Example value"])
     )
+    if "Distinct (est.)" in info:
+        styler = styler.format("{:,.0f}", subset=["Distinct (est.)"], na_rep="")
+    return styler
+
+
+_NULLABLE_INTS = {
+    "int8": "Int8",
+    "int16": "Int16",
+    "int32": "Int32",
+    "uint8": "UInt8",
+    "uint16": "UInt16",
+    "uint32": "UInt32",
+}
+
+
+def _smallest_int_dtype(s: pd.Series, allow_unsigned: bool) -> Optional[str]:
+    lo, hi = s.min(), s.max()
+    if allow_unsigned and lo >= 0:
+        candidates = (np.uint8, np.uint16, np.uint32)
+    else:
+        # unsigned dtypes wrap around on subtraction, e.g. uint8 5 - 10 is 251
+        candidates = (np.int8, np.int16, np.int32)
+    for dtype in candidates:
+        if np.iinfo(dtype).min <= lo and hi <= np.iinfo(dtype).max:
+            name = np.dtype(dtype).name
+            if np.dtype(dtype).itemsize >= s.dtype.itemsize:
+                return None
+            return name if isinstance(s.dtype, np.dtype) else _NULLABLE_INTS[name]
+    return None
+
+
+def _fits_float32(s: pd.Series, chunk_size: int) -> bool:
+    values = s.to_numpy()
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start : start + chunk_size]
+        if not np.array_equal(chunk.astype(np.float32).astype(chunk.dtype), chunk, equal_nan=True):
+            return False
+    return True
+
+
+def _analyze_strings(s: pd.Series, max_categories: int, chunk_size: int) -> Tuple[bool, bool]:
+    """Whether the column holds only strings, and whether it has at most 'max_categories' values."""
+    uniques = set()
+    for start in range(0, len(s), chunk_size):
+        chunk = s.iloc[start : start + chunk_size].dropna()
+        if pd.api.types.infer_dtype(chunk, skipna=False) not in ("string", "empty"):
+            return False, False
+        if uniques is not None:
+            uniques.update(chunk.unique())
+            if len(uniques) > max_categories:
+                uniques = None  # too many, stop collecting
+    return True, uniques is not None
+
+
+def optimize_df_memory(
+    df: pd.DataFrame,
+    max_category_ratio: float = 0.05,
+    max_categories: int = 65_536,
+    arrow_strings: Optional[bool] = None,
+    allow_unsigned: bool = False,
+    chunk_size: int = 1_000_000,
+    styled: bool = True,
+    sample_size: int = 100_000,
+) -> Union[Styler, pd.DataFrame]:
+    """
+    Shrinks the columns of 'df' in place, one column at a time, so the peak memory is about one
+    extra column:
+    - integers are downcast to the smallest signed dtype that holds their min and max (with
+      allow_unsigned, non-negative columns to unsigned dtypes, which wrap around on subtraction)
+    - floats become float32 if every value survives the round trip unchanged
+    - string columns with at most max_category_ratio * (non-null values), and at most
+      'max_categories', distinct values become 'category', other string columns Arrow-backed strings
+      (arrow_strings, default:
+      if pyarrow is installed). The distinct values are collected only up to that bound.
+    - columns without any non-null value are only flagged ("All null")
+    The checks run in chunks of 'chunk_size' rows, so they need little memory beyond the frame
+    itself.
+
+    Returns a report in the format of detailed_df_info(fast=True) after optimization, with the
+    additional columns "DType before", "Mem usage before [MB]" and "All null".
+    """
+    if arrow_strings is None:
+        arrow_strings = importlib.util.find_spec("pyarrow") is not None
+    before = _fast_df_info(df, 100, sample_size, 0)
+
+    all_null = []
+    for i in range(df.shape[1]):
+        s = df.iloc[:, i]
+        n_non_null = len(s) - int(s.isna().sum())
+        all_null.append(n_non_null == 0)
+        if n_non_null == 0:
+            continue
+
+        target = None
+        if pd.api.types.is_bool_dtype(s.dtype):
+            pass
+        elif pd.api.types.is_integer_dtype(s.dtype):
+            target = _smallest_int_dtype(s, allow_unsigned)
+        elif pd.api.types.is_float_dtype(s.dtype) and s.dtype == np.float64:
+            target = "float32" if _fits_float32(s, chunk_size) else None
+        elif s.dtype == object or isinstance(s.dtype, pd.StringDtype):
+            only_strings, few_values = _analyze_strings(
+                s, min(int(max_category_ratio * n_non_null), max_categories), chunk_size
+            )
+            if few_values:
+                target = "category"
+            elif only_strings and arrow_strings and getattr(s.dtype, "storage", None) != "pyarrow":
+                target = "string[pyarrow]"
+        if target is not None:
+            df.isetitem(i, s.astype(target))
+
+    report = _fast_df_info(df, 100, sample_size, 0)
+    report.insert(1, "DType before", before["DType"])
+    report.insert(3, "Mem usage before [MB]", before["Mem usage [MB]"])
+    report["All null"] = pd.Series(all_null, index=df.columns)
+    return _style_df_info(report) if styled else report
+
+
+def _file_format(path: Path) -> str:
+    suffixes = Path(path).suffixes
+    if ".parquet" in suffixes or ".pq" in suffixes:
+        return "parquet"
+    if ".csv" in suffixes:
+        return "csv"
+    raise ValueError(
+        f"Unknown file format of {path}, use .csv (optionally compressed) or .parquet."
+    )
+
+
+def _import_parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Reading and writing Parquet in chunks requires the 'pyarrow' package.")
+    return pyarrow, pyarrow.parquet
+
+
+def read_chunks(
+    path: Path, chunk_size: int = 100_000, columns: Optional[list] = None, **read_kwargs
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads a CSV or Parquet file as DataFrames of at most 'chunk_size' rows, so only one chunk is in
+    memory at a time. Parquet files are read row group by row group. 'read_kwargs' are passed to
+    pd.read_csv or pyarrow's Table.to_pandas.
+    """
+    if _file_format(path) == "csv":
+        with pd.read_csv(path, chunksize=chunk_size, usecols=columns, **read_kwargs) as reader:
+            yield from reader
+        return
+
+    _, pq = _import_parquet()
+    with pq.ParquetFile(path) as f:
+        for batch in f.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas(**read_kwargs)
+
+
+def process_chunks(
+    chunks: Iterable[pd.DataFrame],
+    func: Callable[[pd.DataFrame], Optional[pd.DataFrame]],
+    executor: Optional[str] = None,
+    max_in_flight: Optional[int] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Applies 'func' to every chunk and yields the results in the order of the chunks; None results
+    are skipped.
+    With executor='thread' or 'process', chunks are processed on the persistent pools of
+    execute_all_with_results (for 'process', 'func' needs to be picklable, e.g. a module-level
+    function).
+    At most 'max_in_flight' chunks (default: 2 * number of CPUs) are read ahead, so memory stays
+    bounded.
+    """
+    if executor is None:
+        for chunk in chunks:
+            if (result := func(chunk)) is not None:
+                yield result
+        return
+
+    from .concurrent_helpers import _get_process_pool, _get_thread_pool
+
+    if executor == "thread":
+        pool = _get_thread_pool()
+    elif executor == "process":
+        pool = _get_process_pool()
+    else:
+        raise ValueError(f"Unknown executor {executor}, use None, 'thread' or 'process'.")
+    max_in_flight = max_in_flight or 2 * (os.cpu_count() or 1)
+
+    in_flight = deque()
+    try:
+        for chunk in chunks:
+            in_flight.append(pool.submit(func, chunk))
+            if (
+                len(in_flight) >= max_in_flight
+                and (result := in_flight.popleft().result()) is not None
+            ):
+                yield result
+        while in_flight:
+            if (result := in_flight.popleft().result()) is not None:
+                yield result
+    finally:
+        for fut in in_flight:
+            fut.cancel()
+
+
+class ChunkWriter:
+    """
+    Appends chunks to a CSV or Parquet file (one row group per chunk). The chunks are written to
+    '<path>.part', which replaces 'path' once the writer is closed without an exception, so readers
+    never see a half-written file. Use as a context manager.
+    """
+
+    _CSV_COMPRESSION = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zst": "zstd"}
+
+    def __init__(self, path: Path, **write_kwargs):
+        self.path = Path(path)
+        self.format = _file_format(self.path)
+        self.rows = 0
+        self.write_kwargs = write_kwargs
+        self._tmp_path = self.path.with_name(self.path.name + ".part")
+        self._started = False
+        self._parquet_writer = None
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        if self.format == "csv":
+            chunk.to_csv(
+                self._tmp_path,
+                mode="a" if self._started else "w",
+                header=not self._started,
+                index=False,
+                compression=self._CSV_COMPRESSION.get(self.path.suffix),
+                **self.write_kwargs,
+            )
+        else:
+            pa, pq = _import_parquet()
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(
+                    self._tmp_path, table.schema, **self.write_kwargs
+                )
+            else:
+                # e.g. an all-null column in a later chunk
+                table = table.cast(self._parquet_writer.schema)
+            self._parquet_writer.write_table(table)
+        self._started = True
+        self.rows += len(chunk)
+
+    def close(self, success: bool = True) -> None:
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if success and self._started:
+            os.replace(self._tmp_path, self.path)
+        else:
+            self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "ChunkWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close(success=exc_type is None)
+
+
+def write_chunks(chunks: Iterable[pd.DataFrame], path: Path, **write_kwargs) -> int:
+    """
+    Writes all chunks to a CSV or Parquet file, one at a time, and returns the number of rows
+    written.
+    E.g. write_chunks(process_chunks(read_chunks("in.parquet"), func, executor="process"),
+    "out.parquet").
+    """
+    with ChunkWriter(path, **write_kwargs) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return writer.rows
@@ -1,10 +1,21 @@
-from typing import Any, Union, List
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple, Union, List
+from functools import partial
+from pathlib import Path
+import math
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
 
-__all__ = ["visualize_pt_image_tensor", "PLOTLY_DEF_LAYOUT"]
+__all__ = [
+    "visualize_pt_image_tensor",
+    "visualize_image_grid",
+    "image_grid",
+    "image_grid_pages",
+    "feature_target_correlations",
+    "PLOTLY_DEF_LAYOUT",
+]
 
 TorchTensor = Any
 
@@ -20,33 +31,269 @@ def visualize_pt_image_tensor(tens: TorchTensor) -> None:
     plt.imshow(tens.permute(1, 2, 0).cpu().numpy())
 
 
-def plot_num_feature_correlation(df: pd.DataFrame, target_columns: Union[List, str]):
+def _normalize_params(normalize: Dict) -> Tuple[List[float], List[float]]:
+    """'mean' and 'std' of Normalize params, or of the Normalize in a config's transforms dict."""
+    params = normalize
+    if "mean" not in normalize:
+        params = next((p for name, p in normalize.items() if name.lower() == "normalize"), None)
+        if params is None:
+            raise ValueError("No Normalize in the transforms.")
+    return list(params["mean"]), list(params["std"])
+
+
+def _tensor_thumbnails(
+    images: TorchTensor, thumb_size: int, normalize: Optional[Dict]
+) -> np.ndarray:
+    import torch
+    import torch.nn.functional as F
+
+    x = images.detach()
+    x = x[None] if x.ndim == 3 else x
+    scaled = x.is_floating_point()
+    x = x.float()
+    h, w = x.shape[-2:]
+    # Area interpolation and the un-normalization are both linear, so downsampling first is
+    # equivalent and only touches the small images. On the GPU, only the thumbnails are copied to
+    # the CPU.
+    if max(h, w) > thumb_size:
+        scale = thumb_size / max(h, w)
+        x = F.interpolate(x, size=(max(1, round(h * scale)), max(1, round(w * scale))), mode="area")
+    if normalize is not None:
+        mean, std = _normalize_params(normalize)
+        x = x * x.new_tensor(std).view(-1, 1, 1) + x.new_tensor(mean).view(-1, 1, 1)
+    if scaled and x.numel() and x.max() <= 1:
+        x = x * 255
+    return x.clamp_(0, 255).round_().to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+
+
+def _load_thumbnail(path: Union[str, Path], thumb_size: int) -> np.ndarray:
+    from PIL import Image
+
+    thumb = np.full((thumb_size, thumb_size, 3), 255, dtype=np.uint8)
+    with Image.open(path) as img:
+        # JPEGs are decoded at the smallest of 1/2, 1/4 or 1/8 scale that is still larger than the
+        # thumbnail
+        img.draft("RGB", (thumb_size, thumb_size))
+        img = img.convert("RGB")
+        img.thumbnail((thumb_size, thumb_size))
+        w, h = img.size
+        top, left = (thumb_size - h) // 2, (thumb_size - w) // 2
+        thumb[top : top + h, left : left + w] = np.asarray(img)
+    return thumb
+
+
+def _tile(thumbs: np.ndarray, ncols: Optional[int], padding: int) -> np.ndarray:
+    """Tiles (N, H, W, C) thumbnails row by row into a (rows * H, cols * W, C) image, white gaps."""
+    n, h, w, c = thumbs.shape
+    ncols = max(min(ncols or math.ceil(math.sqrt(n)), n), 1)
+    nrows = max(math.ceil(n / ncols), 1)
+    cells = np.full((nrows, ncols, h + padding, w + padding, c), 255, dtype=np.uint8)
+    cells.reshape(nrows * ncols, h + padding, w + padding, c)[:n, :h, :w] = thumbs
+    grid = cells.transpose(0, 2, 1, 3, 4).reshape(nrows * (h + padding), ncols * (w + padding), c)
+    return grid[: grid.shape[0] - padding, : grid.shape[1] - padding]
+
+
+def image_grid(
+    images: Union[TorchTensor, Sequence[Union[str, Path]]],
+    thumb_size: int = 64,
+    ncols: Optional[int] = None,
+    normalize: Optional[Dict] = None,
+    padding: int = 2,
+) -> np.ndarray:
+    """
+    Downsamples 'images' to fit into thumb_size x thumb_size and tiles them into one (H, W, C) uint8
+    grid image with 'ncols' columns (default: square grid).
+    'images' is an (N, C, H, W) tensor, downsampled for the whole batch at once, or a list of image
+    paths, loaded in threads with reduced-size JPEG decoding.
+    'normalize' undoes a Normalize for tensors: either its params {"mean": ..., "std": ...} or the
+    transforms dict of the config. Float tensors that are in [0, 1] afterwards are scaled to [0,
+    255].
+    """
+    if isinstance(images, (list, tuple)):
+        from .concurrent_helpers import _get_thread_pool
+
+        if not images:
+            return _tile(np.empty((0, thumb_size, thumb_size, 3), dtype=np.uint8), ncols, padding)
+        thumbs = np.stack(
+            list(_get_thread_pool().map(partial(_load_thumbnail, thumb_size=thumb_size), images))
+        )
+    else:
+        thumbs = _tensor_thumbnails(images, thumb_size, normalize)
+    return _tile(thumbs, ncols, padding)
+
+
+def image_grid_pages(
+    images: Union[TorchTensor, Sequence[Union[str, Path]]], page_size: int = 1000, **grid_kwargs
+) -> Iterator[np.ndarray]:
+    """
+    Yields one image_grid (see there for the arguments) per 'page_size' images. Images are only
+    loaded and downsampled when their page is reached.
+    """
+    for start in range(0, len(images), page_size):
+        yield image_grid(images[start : start + page_size], **grid_kwargs)
+
+
+def visualize_image_grid(
+    images: Union[TorchTensor, Sequence[Union[str, Path]]],
+    page: int = 0,
+    page_size: int = 1000,
+    figsize: Tuple[float, float] = (15, 15),
+    **grid_kwargs,
+) -> np.ndarray:
+    """
+    Shows page 'page' (of 'page_size' images each) of 'images' as one grid through plt.imshow and
+    returns the grid. Only the images of that page are loaded, see image_grid for the other
+    arguments.
+    """
+    n_pages = max(math.ceil(len(images) / page_size), 1)
+    if not 0 <= page < n_pages:
+        raise ValueError(f"Page {page} does not exist, there are {n_pages} pages.")
+    first, last = page * page_size, min((page + 1) * page_size, len(images))
+    grid = image_grid(images[first:last], **grid_kwargs)
+
+    plt.figure(figsize=figsize)
+    if grid.shape[-1] == 1:
+        plt.imshow(grid[..., 0], cmap="gray", vmin=0, vmax=255)
+    else:
+        plt.imshow(grid)
+    plt.axis("off")
+    plt.title(f"Images {first} - {last - 1} (page {page + 1}/{n_pages})")
+    return grid
+
+
+def _rank_columns(x: np.ndarray) -> np.ndarray:
+    """Average ranks (from 1) of every column of 'x', like DataFrame.rank(), vectorized."""
+    x = np.ascontiguousarray(x.T)
+    order = np.argsort(x, axis=1)
+    s = np.take_along_axis(x, order, axis=1)
+    idx = np.arange(x.shape[1])
+    first = np.ones(s.shape, dtype=bool)
+    first[:, 1:] = s[:, 1:] != s[:, :-1]
+    last = np.ones(s.shape, dtype=bool)
+    last[:, :-1] = first[:, 1:]
+    # every value gets the mean position of its run of ties in the sorted column
+    start = np.maximum.accumulate(np.where(first, idx, 0), axis=1)
+    end = np.minimum.accumulate(np.where(last, idx, x.shape[1])[:, ::-1], axis=1)[:, ::-1]
+    ranks = np.empty_like(s)
+    np.put_along_axis(ranks, order, (start + end) / 2 + 1, axis=1)
+    ranks[np.isnan(x)] = np.nan
+    return ranks.T
+
+
+def _correlate_columns(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Pearson correlation of every column of 'x' with every column of 'y', both (rows, columns). Like
+    pandas, each pair uses the rows where both values are present.
+    """
+    x_nan, y_nan = np.isnan(x), np.isnan(y)
+    if not x_nan.any() and not y_nan.any():
+        x = x - x.mean(axis=0)
+        y = y - y.mean(axis=0)
+        return (x.T @ y) / np.sqrt(np.outer((x * x).sum(axis=0), (y * y).sum(axis=0)))
+
+    result = np.empty((x.shape[1], y.shape[1]))
+    for j in range(y.shape[1]):
+        mask = ~x_nan & ~y_nan[:, [j]]
+        n = mask.sum(axis=0)
+        xm = np.where(mask, x, 0.0)
+        ym = np.where(mask, y[:, [j]], 0.0)
+        xm -= np.where(mask, xm.sum(axis=0) / np.maximum(n, 1), 0.0)
+        ym -= np.where(mask, ym.sum(axis=0) / np.maximum(n, 1), 0.0)
+        result[:, j] = (xm * ym).sum(axis=0) / np.sqrt(
+            (xm * xm).sum(axis=0) * (ym * ym).sum(axis=0)
+        )
+    return result
+
+
+def feature_target_correlations(
+    df: pd.DataFrame,
+    target_columns: Union[List, str],
+    method: str = "pearson",
+    sample_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    random_state: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Correlations (method 'pearson' or 'spearman') of all numeric columns with the target columns, as
+    a (features x targets) DataFrame. Only the target-vs-feature pairs are computed, in chunks of
+    'chunk_size' features (default: about 8M values per chunk), instead of df.corr()'s full
+    feature-vs-feature matrix.
+    With 'sample_size', a random sample of that many rows is used.
+    For 'spearman' with missing values, every column is ranked on its own, while pandas ranks per
+    pair.
+    """
     if isinstance(target_columns, str):
         target_columns = [target_columns]
-    num_columns = (
+    if method not in ("pearson", "spearman"):
+        raise ValueError(f"Unknown method {method}, use 'pearson' or 'spearman'.")
+    if sample_size is not None and len(df) > sample_size:
+        df = df.sample(n=sample_size, random_state=random_state)
+
+    def _values(columns: List) -> np.ndarray:
+        values = df[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        return _rank_columns(values) if method == "spearman" else values
+
+    features = (
         df.drop(columns=target_columns, errors="ignore").select_dtypes("number").columns.tolist()
     )
+    targets = _values(target_columns)
+    chunk_size = chunk_size or max(1, 2**23 // max(len(df), 1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = np.vstack(
+            [np.empty((0, len(target_columns)))]
+            + [
+                _correlate_columns(_values(features[i : i + chunk_size]), targets)
+                for i in range(0, len(features), chunk_size)
+            ]
+        )
+    return pd.DataFrame(corr, index=features, columns=target_columns)
+
 
-    df_corr = (
-        df[num_columns + target_columns]
-        .corr()[target_columns]
-        .drop(index=target_columns)
-        .sort_values(by=target_columns)
+def plot_num_feature_correlation(
+    df: pd.DataFrame,
+    target_columns: Union[List, str],
+    method: Union[str, List[str]] = "pearson",
+    top_k: Optional[int] = None,
+    sample_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    random_state: Optional[int] = None,
+):
+    """
+    Heatmap of the correlations of all numeric columns with the target columns, see
+    feature_target_correlations. Pass a list of methods, e.g. ["pearson", "spearman"], to show them
+    side by side. With 'top_k', only the k features with the highest absolute correlation (with any
+    target) are shown.
+    """
+    if isinstance(target_columns, str):
+        target_columns = [target_columns]
+    methods = [method] if isinstance(method, str) else list(method)
+
+    df_corr = pd.concat(
+        [
+            feature_target_correlations(
+                df, target_columns, m, sample_size, chunk_size, random_state
+            ).add_suffix(f" {m}" if len(methods) > 1 else " correlations")
+            for m in methods
+        ],
+        axis=1,
     )
+    if top_k is not None:
+        df_corr = df_corr.loc[df_corr.abs().max(axis=1).fillna(0).nlargest(top_k).index]
+    df_corr = df_corr.sort_values(by=df_corr.columns.tolist())
 
     return (
         go.Figure(
             data=go.Heatmap(
                 z=df_corr.values,
                 y=df_corr.index.tolist(),
-                x=[c + " correlations" for c in target_columns],
+                x=df_corr.columns.tolist(),
             )
         )
         .update_layout(PLOTLY_DEF_LAYOUT)
         .update_layout(
-            width=800 + 50 * len(target_columns),
+            width=800 + 50 * len(df_corr.columns),
             height=800,
             title_text=f"Correlation of Cont. columns - {', '.join(target_columns)}",
         )
         .update_yaxes(nticks=len(df_corr))
-    )
\ No newline at end of file
+    )